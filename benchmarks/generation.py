@@ -0,0 +1,35 @@
+import os
+import shutil
+import tempfile
+
+from common.util import SOURCES, generate_file, random_source
+
+from benchmarks.harness import measure
+
+MB = 1024 * 1024
+
+
+def run(sizes=(1, 10, 100), number=3):
+    results = []
+    directory = tempfile.mkdtemp(prefix='benchmark_')
+
+    try:
+        for source in SOURCES:
+            try:
+                random_source(source, seed=0)
+            except ImportError:
+                # numpy is optional
+                continue
+
+            for size in sizes:
+                def generate():
+                    file_path, _ = generate_file(size * MB, tempfile.mkdtemp(dir=directory),
+                                                 source=source, seed=0)
+                    shutil.rmtree(os.path.dirname(file_path))
+
+                results.append(measure('generate_file {} {} MB'.format(source, size), generate,
+                                       number, size * MB, repeat=1, alloc_number=1))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return results
@@ -0,0 +1,161 @@
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import psutil
+
+MB = 1024. * 1024.
+
+
+def ops_per_second(fn, number, repeat=3):
+    best = min(timeit.repeat(fn, number=number, repeat=repeat))
+    return number / best if best else float('inf')
+
+
+class Allocations(object):
+
+    # Allocations over the measured operations: the objects created and left
+    # alive, as counted by the garbage collector (paused meanwhile, so that
+    # garbage cycles are counted as well), the resident set growth and, with
+    # tracemalloc (Python 3), the peak bytes allocated
+
+    traced = tracemalloc is not None
+
+    def __init__(self):
+        self.result = None
+        self._gc_enabled = None
+        self._objects = self._rss = self._alloc = None
+
+    def __enter__(self):
+        gc.collect()
+        self._gc_enabled = gc.isenabled()
+        gc.disable()
+
+        if self.traced:
+            tracemalloc.start()
+            self._alloc = tracemalloc.get_traced_memory()[0]
+        self._rss = _rss()
+        # counted last, with no objects created after it
+        self._objects = len(gc.get_objects())
+        return self
+
+    def __exit__(self, *_):
+        objects = len(gc.get_objects()) - self._objects
+        self.result = dict(objects=objects, rss=max(0, _rss() - self._rss), alloc=None)
+        if self.traced:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.result['alloc'] = peak - self._alloc
+
+        if self._gc_enabled:
+            gc.enable()
+        return False
+
+    def per_op(self, count):
+        return dict((key, None if value is None else value / float(count))
+                    for key, value in self.result.iteritems())
+
+
+def _rss():
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+class Result(dict):
+
+    # ops/s, MB/s (when the size of an operation is known) and allocations
+    # per operation (see Allocations)
+
+    def __init__(self, name, ops, size=None, allocations=None, **extra):
+        allocations = allocations or dict(objects=None, rss=None, alloc=None)
+        super(Result, self).__init__(name=name, ops=ops,
+                                     mb_s=ops * size / MB if size else None,
+                                     **dict(allocations, **extra))
+
+
+def measure(name, fn, number, size=None, repeat=3, alloc_number=None, **extra):
+    ops = ops_per_second(fn, number, repeat)
+
+    alloc_number = alloc_number or number
+    with Allocations() as allocations:
+        for _ in xrange(alloc_number):
+            fn()
+    return Result(name, ops, size, allocations.per_op(alloc_number), **extra)
+
+
+def measure_timed(name, elapsed, count, size=None, allocations=None, **extra):
+    # for benchmarks timing themselves, e.g. across threads
+    return Result(name, count / elapsed if elapsed else float('inf'), size,
+                  allocations.per_op(count) if allocations else None, **extra)
+
+
+def environment():
+    return dict(python=sys.version.split()[0], implementation=platform.python_implementation(),
+                platform=platform.platform(), machine=platform.machine(),
+                tracemalloc=Allocations.traced, time=time.time())
+
+
+def save_baseline(path, results):
+    with open(path, 'wb') as f:
+        json.dump(dict(environment=environment(), results=results), f, indent=2,
+                  sort_keys=True)
+
+
+def load_baseline(path):
+    with open(path, 'rb') as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold=0.1):
+    # (name, current ops/s, baseline ops/s, ratio, regressed) for each result;
+    # a result regresses when it is more than `threshold` slower
+    previous = dict((r['name'], r) for r in baseline.get('results', []))
+    rows = []
+
+    for result in results:
+        old = previous.get(result['name'])
+        if not old or not old.get('ops'):
+            rows.append((result['name'], result['ops'], None, None, False))
+            continue
+
+        ratio = result['ops'] / old['ops']
+        rows.append((result['name'], result['ops'], old['ops'], ratio, ratio < 1 - threshold))
+
+    return rows
+
+
+def format_results(results):
+    row = '{:<52} {:>14} {:>10} {:>12} {:>12}'
+    header = ['benchmark', 'ops/s', 'MB/s', 'objects/op', 'RSS [B/op]']
+    if Allocations.traced:
+        row += ' {:>14}'
+        header.append('alloc [B/op]')
+    lines = [row.format(*header)]
+
+    for r in results:
+        lines.append(row.format(r['name'], _fmt(r['ops'], 1), _fmt(r['mb_s'], 2),
+                                _fmt(r.get('objects'), 2), _fmt(r.get('rss'), 0),
+                                _fmt(r.get('alloc'), 0)))
+    return '\n'.join(lines)
+
+
+def format_comparison(rows):
+    row = '{:<52} {:>14} {:>14} {:>8} {}'
+    lines = [row.format('benchmark', 'ops/s', 'baseline', 'ratio', '')]
+
+    for name, ops, old, ratio, regressed in rows:
+        lines.append(row.format(name, _fmt(ops, 1), _fmt(old, 1), _fmt(ratio, 3),
+                                'REGRESSION' if regressed else ''))
+    return '\n'.join(lines)
+
+
+def _fmt(value, precision):
+    return '-' if value is None else '{:.{}f}'.format(value, precision)
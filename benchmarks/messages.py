@@ -0,0 +1,74 @@
+import struct
+
+from network.encoding import ENCODINGS
+from network.message import MESSAGES, HEADER_STRUCTS, Message, Hello, GetAddress, Address, \
+    GetResources, Resources, Result, ResultAck
+from network.protocol import Protocol
+
+from benchmarks.harness import measure
+from benchmarks.serialization import ipfs_hashes, dat_hashes
+
+
+class DecodingProtocol(Protocol):
+
+    # Only used for to_message; never started
+
+    def start(self):
+        pass
+
+    def heartbeat(self):
+        pass
+
+
+def samples(counts):
+    single = ipfs_hashes(1)[0]
+
+    yield Hello, 'Hello', Hello('node-0123')
+    yield GetAddress, 'GetAddress', GetAddress()
+    yield Address, 'Address', Address(single)
+    yield GetResources, 'GetResources', GetResources()
+    yield GetResources, 'GetResources(round)', GetResources(7)
+    yield Result, 'Result', Result(single)
+    yield Result, 'Result(round)', Result(single, 7)
+    yield ResultAck, 'ResultAck', ResultAck(single, 7)
+
+    for kind, generate in (('ipfs', ipfs_hashes), ('dat', dat_hashes)):
+        for count in counts:
+            yield Resources, 'Resources[{} {}]'.format(count, kind), Resources(generate(count))
+
+
+def run(counts=(10, 1000, 5000), number=200):
+    protocol = DecodingProtocol('bench', '127.0.0.1:0')
+    results = []
+    covered = set()
+
+    for cls, name, msg in samples(counts):
+        covered.add(cls)
+
+        for encoding, version in sorted(ENCODINGS.iteritems()):
+            try:
+                packed = msg.pack('src', 'dst', version=version)
+            except (struct.error, RuntimeError):
+                # too large for the legacy header, or msgpack is not installed
+                continue
+
+            header = HEADER_STRUCTS[version]
+            _, msg_id, src_len, dst_len, _ = Message.unpack_header(packed)
+            content = packed[header.size + src_len + dst_len:]
+            size = len(packed)
+            prefix = 'message {} {}'.format(name, encoding)
+
+            results.append(measure(prefix + ' pack',
+                                   lambda: msg.pack('src', 'dst', version=version),
+                                   number, size))
+            results.append(measure(prefix + ' unpack_header',
+                                   lambda: Message.unpack_header(packed),
+                                   number * 10))
+            results.append(measure(prefix + ' to_message',
+                                   lambda: protocol.to_message(version, msg_id, content),
+                                   number, size))
+
+    missing = set(MESSAGES) - covered
+    assert not missing, 'No samples for: {}'.format(', '.join(c.__name__ for c in missing))
+    return results
+
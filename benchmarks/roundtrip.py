@@ -0,0 +1,208 @@
+import random
+import socket
+import threading
+import time
+
+from network.message import GetResources, Resources, Result, VERSION
+from network.protocol import Protocol, ServerProtocol, ClientProtocol
+from network.transport import TRANSPORTS, EventLoopTransport
+
+from benchmarks.harness import Allocations, measure_timed
+
+TIMEOUT = 60
+
+
+class PingProtocol(Protocol):
+
+    # Sends `count` Result messages one at a time, each after the previous
+    # one has been echoed back by an EchoProtocol
+
+    def __init__(self, name, payload, count, **kwargs):
+        super(PingProtocol, self).__init__(name, '127.0.0.1:0', **kwargs)
+        self.payload = payload
+        self.count = count
+        self.received = 0
+        self.done = threading.Event()
+
+    def start(self):
+        self.working = True
+
+    def heartbeat(self):
+        pass
+
+    def on_message(self, protocol, sock, msg_wrapper):
+        if super(PingProtocol, self).on_message(protocol, sock, msg_wrapper):
+            # the echo side said hello: start
+            self.send(sock, Result(self.payload))
+        elif isinstance(msg_wrapper.msg, Result):
+            self.received += 1
+            if self.received >= self.count:
+                self.done.set()
+            else:
+                self.send(sock, Result(self.payload))
+
+
+class EchoProtocol(Protocol):
+
+    def start(self):
+        self.working = True
+
+    def heartbeat(self):
+        pass
+
+    def on_message(self, protocol, sock, msg_wrapper):
+        if not super(EchoProtocol, self).on_message(protocol, sock, msg_wrapper):
+            self.send(sock, msg_wrapper.msg)
+
+
+def socketpair_round_trip(transport, payload_size, count, version=VERSION):
+    payload = 'x' * payload_size
+    transport_cls = TRANSPORTS[transport]
+
+    ping = PingProtocol('ping', payload, count, transport=transport_cls, version=version)
+    echo = EchoProtocol('echo', '127.0.0.1:0', transport=transport_cls, version=version)
+    ping_sock, echo_sock = socket.socketpair()
+
+    # the event loop expects non-blocking sockets, as set up by the protocols
+    for sock in (ping_sock, echo_sock):
+        sock.setblocking(not issubclass(transport_cls, EventLoopTransport))
+
+    with Allocations() as allocations:
+        started = time.time()
+        threads = []
+
+        for protocol, sock in ((echo, echo_sock), (ping, ping_sock)):
+            protocol.start()
+            thread = threading.Thread(target=protocol.transport.run, args=(sock, protocol.name))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        completed = ping.done.wait(TIMEOUT)
+        elapsed = time.time() - started
+
+    for protocol in (ping, echo):
+        protocol.stop()
+    for sock in (ping_sock, echo_sock):
+        _close(sock)
+
+    if not completed:
+        raise RuntimeError('Round trip benchmark timed out after {} s'.format(TIMEOUT))
+
+    size = 2 * len(Result(payload).pack('ping', 'echo', version=version))
+    return measure_timed('round trip {} {} B'.format(transport, payload_size), elapsed, count,
+                         size, allocations)
+
+
+class RelayServer(ServerProtocol):
+
+    def __init__(self, *args, **kwargs):
+        super(RelayServer, self).__init__(*args, **kwargs)
+        self.received = 0
+
+    def heartbeat(self):
+        pass
+
+    def _on_get_address(self, protocol, sock, msg_wrapper):
+        pass
+
+    def _on_result_message(self, protocol, sock, msg_wrapper):
+        self.received += 1
+
+    def _on_get_resources_message(self, protocol, sock, msg_wrapper):
+        protocol.send(sock, Resources([]), dst=msg_wrapper.src)
+
+
+class RelayClient(ClientProtocol):
+
+    # Streams `count` Result messages to the server through the proxy,
+    # followed by a GetResources answered once all of them have arrived
+
+    def __init__(self, name, address, payload, count, **kwargs):
+        super(RelayClient, self).__init__(name, address, **kwargs)
+        self.payload = payload
+        self.count = count
+        self.started = None
+        self.finished = None
+
+    def heartbeat(self):
+        pass
+
+    def on_connect(self, protocol, sock):
+        super(RelayClient, self).on_connect(protocol, sock)
+        thread = threading.Thread(target=self._stream, args=(protocol, sock))
+        thread.daemon = True
+        thread.start()
+
+    def _stream(self, protocol, sock):
+        # the proxy needs to register this client before relaying
+        time.sleep(0.2)
+        self.started = time.time()
+        msg = Result(self.payload)
+        for _ in xrange(self.count):
+            protocol.send(sock, msg)
+        protocol.send(sock, GetResources())
+
+    def _on_resources_message(self, protocol, sock, msg_wrapper):
+        self.finished = time.time()
+        self.stop()
+
+    def _on_address_message(self, protocol, sock, msg_wrapper):
+        pass
+
+
+def relay(transport, payload_size, count, raw_relay=True, version=VERSION):
+    address = '127.0.0.1:{}'.format(random.randint(20000, 60000))
+    kwargs = dict(transport=TRANSPORTS[transport], raw_relay=raw_relay, version=version)
+    payload = 'x' * payload_size
+
+    proxy = RelayServer('proxy', address, **kwargs)
+    server = RelayServer('server', address, proxy=(address, None), **kwargs)
+    client = RelayClient('client', address, payload, count, proxy=(address, 'server'), **kwargs)
+
+    with Allocations() as allocations:
+        for node in (proxy, server):
+            thread = threading.Thread(target=node.start)
+            thread.daemon = True
+            thread.start()
+            time.sleep(0.2)
+
+        thread = threading.Thread(target=client.start)
+        thread.daemon = True
+        thread.start()
+        thread.join(TIMEOUT)
+
+    for node in (client, server, proxy):
+        node.stop()
+
+    if not client.finished:
+        raise RuntimeError('Relay benchmark timed out after {} s'.format(TIMEOUT))
+
+    size = len(Result(payload).pack('client', 'server', version=version))
+    return measure_timed('relay {} {} {} B'.format(transport, 'raw' if raw_relay else 'decoded',
+                                                   payload_size),
+                         client.finished - client.started, count, size, allocations,
+                         delivered=server.received)
+
+
+def run(payload_sizes=(64, 4096, 65536), count=2000):
+    results = []
+
+    for transport in sorted(TRANSPORTS):
+        for payload_size in payload_sizes:
+            results.append(socketpair_round_trip(transport, payload_size, count))
+
+    for transport in sorted(TRANSPORTS):
+        for raw_relay in (True, False):
+            for payload_size in payload_sizes:
+                results.append(relay(transport, payload_size, count * 5, raw_relay))
+
+    return results
+
+
+def _close(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+        pass
+    sock.close()
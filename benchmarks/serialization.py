@@ -0,0 +1,96 @@
+import binascii
+import os
+import random
+import struct
+
+import click
+
+from network.encoding import ENCODINGS, VERSION_JSON
+from network.message import Address, Resources, Result, LEGACY_HEADER_STRUCT_FMT
+
+from benchmarks.harness import ops_per_second
+
+
+B58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+def ipfs_hashes(count):
+    return ['Qm' + ''.join(random.choice(B58_ALPHABET) for _ in xrange(44))
+            for _ in xrange(count)]
+
+
+def dat_hashes(count):
+    return [binascii.hexlify(os.urandom(32)) for _ in xrange(count)]
+
+
+def legacy_pack(msg, src, dst):
+    serialized = str(msg.serialize(VERSION_JSON))
+    header = struct.Struct('{}{}s{}s{}s'.format(LEGACY_HEADER_STRUCT_FMT,
+                                                len(src), len(dst),
+                                                len(serialized)))
+    return header.pack(VERSION_JSON, msg.ID, len(src), len(dst), len(serialized),
+                       src, dst, serialized)
+
+
+def cases(counts):
+    for kind, generate in (('ipfs', ipfs_hashes), ('dat', dat_hashes)):
+        single = generate(1)[0]
+        yield '{} Result'.format(kind), Result(single)
+        yield '{} Address'.format(kind), Address(single)
+        for count in counts:
+            yield '{} Resources[{}]'.format(kind, count), Resources(generate(count))
+
+
+def bench_message(msg, version, number):
+    cls = msg.__class__
+
+    try:
+        packed = msg.pack('src', 'dst', version=version)
+    except struct.error:
+        return None
+
+    content = packed[-len(msg.serialize(version)):] if msg.serialize(version) else ''
+
+    def unpack():
+        instance = cls.__new__(cls)
+        instance.deserialize(content, version)
+
+    return (ops_per_second(lambda: msg.pack('src', 'dst', version=version), number),
+            ops_per_second(unpack, number),
+            len(packed))
+
+
+@click.command()
+@click.option('--count', '-c', multiple=True, type=int, default=[10, 100, 1000, 5000],
+              help='Number of hashes in Resources messages')
+@click.option('--number', '-n', default=200,
+              help='Iterations per measurement')
+def main(count, number):
+    row = '{:<22} {:<10} {:>14} {:>14} {:>12}'
+    print(row.format('message', 'encoding', 'pack [op/s]', 'unpack [op/s]', 'size [B]'))
+
+    for name, msg in cases(count):
+
+        try:
+            legacy = legacy_pack(msg, 'src', 'dst')
+        except struct.error:
+            legacy = None
+        if legacy:
+            print(row.format(name, 'legacy', '{:.0f}'.format(ops_per_second(
+                lambda: legacy_pack(msg, 'src', 'dst'), number)), '-', len(legacy)))
+
+        for encoding in sorted(ENCODINGS):
+            try:
+                result = bench_message(msg, ENCODINGS[encoding], number)
+            except RuntimeError:
+                continue
+
+            if result:
+                print(row.format(name, encoding, '{:.0f}'.format(result[0]),
+                                 '{:.0f}'.format(result[1]), result[2]))
+            else:
+                print(row.format(name, encoding, 'n/a', 'n/a', 'too large'))
+
+
+if __name__ == '__main__':
+    main()
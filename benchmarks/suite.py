@@ -0,0 +1,64 @@
+import sys
+
+import click
+
+from common.logger import logger
+
+from benchmarks import generation, messages, roundtrip
+from benchmarks.harness import compare, format_comparison, format_results, load_baseline, \
+    save_baseline
+
+GROUPS = ['messages', 'roundtrip', 'generation']
+
+
+def run_group(group, quick):
+    if group == 'messages':
+        return messages.run(counts=(10, 1000) if quick else (10, 1000, 5000),
+                            number=50 if quick else 200)
+    elif group == 'roundtrip':
+        return roundtrip.run(payload_sizes=(64, 65536) if quick else (64, 4096, 65536),
+                             count=200 if quick else 2000)
+    elif group == 'generation':
+        return generation.run(sizes=(1, 10) if quick else (1, 10, 100),
+                              number=1 if quick else 3)
+    raise ValueError('Unknown benchmark group: {}'.format(group))
+
+
+@click.command()
+@click.option('--group', '-g', type=click.Choice(GROUPS), multiple=True,
+              help='Benchmark groups to run (default: all)')
+@click.option('--quick', '-q', is_flag=True, default=False,
+              help='Fewer iterations and sizes')
+@click.option('--save', nargs=1, default=None,
+              help='Save the results as a baseline JSON file')
+@click.option('--compare', 'baseline', nargs=1, default=None,
+              help='Compare the results with a baseline JSON file')
+@click.option('--threshold', nargs=1, type=float, default=0.1,
+              help='Relative slowdown reported as a regression')
+def main(group, quick, save, baseline, threshold):
+    # the benchmarked code logs every generated file and closed connection
+    logger.configure('warning', background=False)
+
+    results = []
+    for name in group or GROUPS:
+        click.echo('Running {} benchmarks'.format(name), err=True)
+        results.extend(run_group(name, quick))
+
+    click.echo(format_results(results))
+
+    if save:
+        save_baseline(save, results)
+        click.echo('\nBaseline saved to {}'.format(save))
+
+    if baseline:
+        rows = compare(results, load_baseline(baseline), threshold)
+        click.echo('\n' + format_comparison(rows))
+
+        regressions = [row[0] for row in rows if row[4]]
+        if regressions:
+            click.echo('\n{} regression(s) over {:.0%}'.format(len(regressions), threshold))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import atexit
+import os
+import sys
+import threading
+import time
+from Queue import Queue, Empty
+
+TRACE = 5
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {
+    'trace': TRACE,
+    'debug': DEBUG,
+    'info': INFO,
+    'warning': WARNING,
+    'error': ERROR,
+}
+
+_CLOSE = object()
+
+
+class Logger(object):
+
+    # Records are queued as (time, message, args) and formatted by a single
+    # writer thread, which writes them out in batches. Callers on hot paths
+    # should check `tracing` before building any arguments at all.
+
+    def __init__(self, level=INFO, stream=None, batch_size=256, flush_interval=0.2):
+        self.level = level
+        self.tracing = level <= TRACE
+        self.stream = stream or sys.stdout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def configure(self, level=None, file_path=None, background=True):
+        self.close()
+
+        if level is not None:
+            self.level = LEVELS.get(level, level)
+            self.tracing = self.level <= TRACE
+        if file_path:
+            self._file = open(file_path, 'ab')
+            self.stream = self._file
+        if background:
+            self.start()
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            self._queue = Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._work)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread:
+                self._queue.put(_CLOSE)
+
+        if thread and self._pid == os.getpid():
+            thread.join()
+        if self._file:
+            self._file.close()
+            self._file = None
+            self.stream = sys.stdout
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, message, *args):
+        if level < self.level:
+            return
+
+        record = (time.time(), message, args)
+        # forked processes do not inherit the writer thread
+        if self._thread and self._pid == os.getpid():
+            self._queue.put(record)
+        else:
+            self._write([record])
+
+    def trace(self, message, *args):
+        self.log(TRACE, message, *args)
+
+    def debug(self, message, *args):
+        self.log(DEBUG, message, *args)
+
+    def info(self, message, *args):
+        self.log(INFO, message, *args)
+
+    def warning(self, message, *args):
+        self.log(WARNING, message, *args)
+
+    def error(self, message, *args):
+        self.log(ERROR, message, *args)
+
+    def _work(self):
+        queue = self._queue
+        closing = False
+
+        while not closing:
+            try:
+                batch = [queue.get(timeout=self.flush_interval)]
+            except Empty:
+                continue
+
+            closing = batch[0] is _CLOSE
+
+            while len(batch) < self.batch_size or closing:
+                try:
+                    batch.append(queue.get_nowait())
+                except Empty:
+                    break
+                if batch[-1] is _CLOSE:
+                    closing = True
+
+            self._write([record for record in batch if record is not _CLOSE])
+
+    def _write(self, records):
+        lines = []
+
+        for timestamp, message, args in records:
+            if args:
+                try:
+                    message = message.format(*args)
+                except Exception as exc:
+                    message = '{} {!r} ({})'.format(message, args, exc)
+            lines.append('[{}] {}\n'.format(timestamp, message))
+
+        if lines:
+            self.stream.write(''.join(lines))
+            self.stream.flush()
+
+
+logger = Logger()
+atexit.register(logger.close)
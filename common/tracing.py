@@ -0,0 +1,199 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+from contextlib import contextmanager
+
+from common.util import log
+
+Span = namedtuple('Span', ['name', 'session', 'round', 'thread', 'started', 'finished', 'args'])
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+
+class NullTracer(object):
+
+    # Default tracer: spans cost a single call returning a shared object
+
+    enabled = False
+
+    _span = _NullSpan()
+
+    def span(self, name, session=None, round_id=None, **args):
+        return self._span
+
+    def record(self, name, started, finished, session=None, round_id=None, **args):
+        pass
+
+
+NULL_TRACER = NullTracer()
+
+
+def self_times(spans):
+    # Time spent in each span, less the time of the spans nested in it on
+    # the same thread. Where spans of several threads overlap, the time is
+    # split between them, so that self times never exceed the wall time.
+    times = defaultdict(float)
+    bounds = sorted(set(t for span in spans for t in (span.started, span.finished)))
+
+    for started, finished in zip(bounds, bounds[1:]):
+        innermost = {}
+        for span in spans:
+            if span.started <= started and span.finished >= finished:
+                current = innermost.get(span.thread)
+                if current is None or span.started > current.started or \
+                        (span.started == current.started and span.finished < current.finished):
+                    innermost[span.thread] = span
+
+        for span in innermost.itervalues():
+            times[span.name] += (finished - started) / len(innermost)
+
+    return dict(times)
+
+
+class Tracer(object):
+
+    # Spans are kept in memory until written out. A span without a session
+    # or a round id takes the ones of the enclosing span of the same thread.
+
+    enabled = True
+
+    def __init__(self):
+        self.spans = []
+        self.started = time.time()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, session=None, round_id=None, **args):
+        stack = self._stack()
+        if stack:
+            session = session if session is not None else stack[-1][0]
+            round_id = round_id if round_id is not None else stack[-1][1]
+
+        stack.append((session, round_id))
+        started = time.time()
+        try:
+            yield
+        finally:
+            stack.pop()
+            self.record(name, started, time.time(), session, round_id, **args)
+
+    def record(self, name, started, finished, session=None, round_id=None, **args):
+        stack = self._stack()
+        if stack:
+            session = session if session is not None else stack[-1][0]
+            round_id = round_id if round_id is not None else stack[-1][1]
+
+        span = Span(name, session, round_id, threading.current_thread().ident,
+                    started, finished, args)
+        with self._lock:
+            self.spans.append(span)
+
+    def active(self):
+        return bool(self._stack())
+
+    def breakdown(self):
+        # per (session, round): wall time, the total time spent in each span,
+        # and each span's self time (see self_times)
+        rounds = OrderedDict()
+
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.started)
+
+        for span in spans:
+            if span.round is None:
+                continue
+
+            key = (span.session, span.round)
+            entry = rounds.get(key)
+            if not entry:
+                entry = rounds[key] = dict(session=span.session, round=span.round,
+                                           started=span.started, finished=span.finished,
+                                           phases=defaultdict(float), spans=[])
+
+            entry['started'] = min(entry['started'], span.started)
+            entry['finished'] = max(entry['finished'], span.finished)
+            entry['phases'][span.name] += span.finished - span.started
+            entry['spans'].append(span)
+
+        result = []
+        for entry in rounds.itervalues():
+            entry['wall'] = entry['finished'] - entry['started']
+            entry['phases'] = dict(entry['phases'])
+            entry['self'] = self_times(entry.pop('spans'))
+            result.append(entry)
+        return result
+
+    def report(self):
+        # shares of self time, which add up to at most the wall time
+        rounds = self.breakdown()
+        if not rounds:
+            return ''
+
+        totals = defaultdict(float)
+        for entry in rounds:
+            for name, elapsed in entry['self'].iteritems():
+                totals[name] += elapsed
+        wall = sum(entry['wall'] for entry in rounds)
+
+        res = 'Rounds traced: {}, mean wall time {:.6f} s\n'.format(len(rounds),
+                                                                   wall / len(rounds))
+        for name, elapsed in sorted(totals.iteritems(), key=lambda i: -i[1]):
+            res += '{:<16} {:>12.6f} s/round {:>7.1f}% of wall time\n'.format(
+                name, elapsed / len(rounds), 100. * elapsed / wall if wall else 0.)
+        return res
+
+    def chrome_trace(self):
+        with self._lock:
+            spans = list(self.spans)
+
+        sessions = OrderedDict()
+        events = []
+
+        for span in spans:
+            pid = sessions.setdefault(span.session, len(sessions) + 1)
+            args = dict(span.args)
+            if span.round is not None:
+                args['round'] = span.round
+
+            events.append(dict(name=span.name, cat='session', ph='X', pid=pid, tid=span.thread,
+                               ts=(span.started - self.started) * 1e6,
+                               dur=(span.finished - span.started) * 1e6,
+                               args=args))
+
+        for session, pid in sessions.iteritems():
+            events.append(dict(name='process_name', ph='M', pid=pid,
+                               args=dict(name=str(session))))
+
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+    def write(self, log_dir, run):
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+
+        trace_path = os.path.join(log_dir, '{}_trace.json'.format(run))
+        rounds_path = os.path.join(log_dir, '{}_rounds.json'.format(run))
+
+        with open(trace_path, 'wb') as f:
+            json.dump(self.chrome_trace(), f)
+        with open(rounds_path, 'wb') as f:
+            json.dump(self.breakdown(), f, indent=2)
+
+        log('Trace written to {} ({} spans), round breakdown to {}'
+            .format(trace_path, len(self.spans), rounds_path))
+        return trace_path, rounds_path
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
@@ -1,38 +1,111 @@
+import binascii
 import hashlib
 import os
 import random
-import sys
 import time
+import uuid
 
 import multihash
 
-SHA1_BLOCK_SIZE = 64
+from common.logger import logger
+
+CHUNK_SIZE = 1024 * 1024
 DEV_NULL = open(os.devnull, 'w')
 
+SOURCE_URANDOM = 'urandom'
+SOURCE_PRNG = 'prng'
+SOURCE_NUMPY = 'numpy'
+SOURCES = [SOURCE_URANDOM, SOURCE_PRNG, SOURCE_NUMPY]
 
-def generate_file(size_bytes, output_dir):
 
-    data = bytearray(random.getrandbits(8) for _ in xrange(size_bytes))
-    sha = hashlib.sha256()
+def random_source(source=None, seed=None):
 
-    start = 0
-    while start < size_bytes:
-        buf = data[start:start+SHA1_BLOCK_SIZE]
-        start += SHA1_BLOCK_SIZE
-        sha.update(buf)
+    if source is None:
+        source = SOURCE_URANDOM if seed is None else SOURCE_PRNG
 
-    digest = sha.hexdigest()
-    encoded = multihash.encode(digest, multihash.SHA2_256)
-    file_name = ''.join('{:02x}'.format(x) for x in encoded)
-    file_path = os.path.join(output_dir, file_name)
+    if source == SOURCE_URANDOM:
+        return os.urandom
+
+    elif source == SOURCE_PRNG:
+        rng = random.Random(seed)
+
+        def read(size):
+            bits = rng.getrandbits(size * 8)
+            return binascii.unhexlify('%0*x' % (size * 2, bits))
+        return read
+
+    elif source == SOURCE_NUMPY:
+        import numpy
+        # RandomState only accepts 32 bit seeds
+        rng = numpy.random.RandomState(seed & 0xffffffff if seed is not None else None)
+        return rng.bytes
+
+    raise ValueError('Unknown random source: {}'.format(source))
+
+
+def generate_file(size_bytes, output_dir, source=None, seed=None,
+                  chunk_size=CHUNK_SIZE):
 
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    with open(file_path, 'wb') as f:
-        f.write(data)
+    read = random_source(source, seed)
+    sha = hashlib.sha256()
+    tmp_path = os.path.join(output_dir, '.{}.tmp'.format(uuid.uuid4()))
+    started = time.time()
+
+    with open(tmp_path, 'wb') as f:
+        remaining = size_bytes
+        while remaining > 0:
+            chunk = read(min(chunk_size, remaining))
+            sha.update(chunk)
+            f.write(chunk)
+            remaining -= len(chunk)
+
+    elapsed = time.time() - started
+
+    file_name = multihash_hex(sha)
+    file_path = os.path.join(output_dir, file_name)
+
+    if os.path.exists(file_path):
+        os.remove(tmp_path)
+    else:
+        os.rename(tmp_path, file_path)
+
+    log('Generated {} ({:.2f} MB in {:.3f} s, {:.2f} MB/s)'
+        .format(file_name, size_bytes / 1048576., elapsed,
+                size_bytes / 1048576. / elapsed if elapsed else float('inf')))
+
     return file_path, file_name
 
 
-def log(message):
-    sys.stdout.write('[{}] {}\n'.format(time.time(), message))
+def multihash_hex(sha):
+    encoded = multihash.encode(sha.hexdigest(), multihash.SHA2_256)
+    return ''.join('{:02x}'.format(x) for x in encoded)
+
+
+def file_multihash(file_path, chunk_size=CHUNK_SIZE):
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            sha.update(chunk)
+            chunk = f.read(chunk_size)
+    return multihash_hex(sha)
+
+
+def tree_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    total = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            file_path = os.path.join(root, file_name)
+            if not os.path.islink(file_path):
+                total += os.path.getsize(file_path)
+    return total
+
+
+def log(message, *args):
+    logger.info(message, *args)
@@ -1,12 +1,55 @@
+import json
+import os
+import sys
+import time
+
 import click
 import stun
 
+from common.logger import LEVELS, logger
+from common.tracing import Tracer
+from common.util import SOURCES, SOURCE_URANDOM
+from monitor.compare import DEFAULT_GROUP, GROUP_FIELDS, Bootstrap, RunSet, compare, \
+    format_comparison, regressions
+from monitor.exporter import MetricsExporter
+from monitor.load import ClientFactory, LoadGenerator
 from monitor.monitor import Monitor
+from monitor.profiling import PROFILES, create_profiler
+from monitor.sink import FORMATS, ResultsSink
+from network.encoding import ENCODINGS
+from network.transport import TRANSPORTS
+from resources.cache import LINKS, LINK_AUTO, ResourceCache
+from resources.dat.commands import DatCommands
 from resources.dat.logic import DatServerSession, DatClientSession
-from resources.ipfs.logic import IPFSClientSession, IPFSServerSession
+from resources.ipfs.commands import IPFSAPICommands
+from resources.ipfs.logic import IPFSClientSession, IPFSServerSession, IPFSAPIClientSession, \
+    IPFSAPIServerSession
+from resources.local.commands import LocalCommands
+from resources.local.logic import LocalClientSession, LocalServerSession
+from resources.scenario import Scenario
+
+
+class DefaultGroup(click.Group):
+
+    # Arguments that do not start with a command name are passed to the
+    # default command, so that `main.py NAME ADDRESS [OPTIONS]` still runs a session
+
+    def __init__(self, *args, **kwargs):
+        self.default_command = kwargs.pop('default_command')
+        super(DefaultGroup, self).__init__(*args, **kwargs)
 
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and args[0] not in ctx.help_option_names:
+            args.insert(0, self.default_command)
+        return super(DefaultGroup, self).parse_args(ctx, args)
 
-@click.command()
+
+@click.group(cls=DefaultGroup, default_command='run')
+def cli():
+    pass
+
+
+@cli.command('run')
 @click.argument('name')
 @click.argument('address')
 @click.option('--client', '-c', is_flag=True, default=False,
@@ -25,39 +68,162 @@ from resources.ipfs.logic import IPFSClientSession, IPFSServerSession
               help='Number of tasks to simulate (client only)')
 @click.option('--size', '-sz', nargs=1, default=10,
               help='Generated file size [MB]')
+@click.option('--source', '-src', type=click.Choice(SOURCES), default=None,
+              help='Random data source for generated files '
+                   '(default: urandom, or prng when seeded)')
+@click.option('--seed', nargs=1, type=int, default=None,
+              help='Seed for reproducible file contents')
+@click.option('--scenario', nargs=1, default=None,
+              help='Workload scenario file (JSON, or YAML with PyYAML installed)')
+@click.option('--content', type=click.Choice(['cold', 'warm']), default='cold',
+              help='Generate unique files every round, or repeat cached files')
+@click.option('--cache-dir', nargs=1, default=None,
+              help='Directory of the warm content cache (default: <output_dir>/cache)')
+@click.option('--cache-budget', nargs=1, default=0,
+              help='Disk budget of the warm content cache [MB], 0 for unlimited')
+@click.option('--link', type=click.Choice(LINKS), default=LINK_AUTO,
+              help='How cached files are placed in round directories')
+@click.option('--concurrency', '-j', nargs=1, default=1,
+              help='Number of concurrent resource downloads (client only)')
+@click.option('--pipeline', nargs=1, default=1,
+              help='Number of rounds in flight, 1 to wait for each round (client only)')
+@click.option('--result-workers', nargs=1, default=4,
+              help='Number of threads fetching results of pipelined rounds (server only)')
+@click.option('--clients', '-n', nargs=1, default=1,
+              help='Number of client sessions to run against the server (client only)')
+@click.option('--ramp-up', nargs=1, type=float, default=0,
+              help='Time over which the client sessions are started [s]')
+@click.option('--ramp-step', nargs=1, default=1,
+              help='Number of client sessions started at a time during ramp-up')
+@click.option('--processes', nargs=1, default=0,
+              help='Run the client sessions in a pool of processes, 0 for threads')
+@click.option('--pool-depth', '-pd', nargs=1, default=0,
+              help='Number of rounds of resources to generate ahead (server only)')
+@click.option('--pool-budget', '-pb', nargs=1, default=0,
+              help='Disk budget of the resource pool [MB], 0 for unlimited')
 @click.option('--timeout', '-to', nargs=1, default=120,
               help='Download timeout')
+@click.option('--metrics-port', nargs=1, default=0,
+              help='Serve live metrics in the Prometheus text format on this port, 0 to disable')
+@click.option('--metrics-host', nargs=1, default='127.0.0.1',
+              help='Address to serve live metrics on')
+@click.option('--spans', is_flag=True, default=False,
+              help='Record timing spans of each round, written to the log directory '
+                   'as a Chrome trace and a per-round breakdown')
+@click.option('--profile', type=click.Choice(PROFILES), default=None,
+              help='Profile all threads with cProfile, or by sampling their stacks; '
+                   'written to the log directory in the pstats / collapsed stack format')
+@click.option('--profile-interval', nargs=1, type=float, default=0.005,
+              help='Interval between stack samples [s]')
+@click.option('--profile-rounds', is_flag=True, default=False,
+              help='Write a profile of every round, in addition to the whole session')
+@click.option('--results', '-R', type=click.Choice(FORMATS + ['none']), default='jsonl',
+              help='Format of the download results written to the log directory')
+@click.option('--parquet', is_flag=True, default=False,
+              help='Also convert the results to Parquet at the end of the run')
+@click.option('--log-level', type=click.Choice(sorted(LEVELS, key=LEVELS.get)), default='info',
+              help='Console / log file verbosity')
+@click.option('--log-file', nargs=1, default=None,
+              help='Write the log to a file instead of stdout')
+@click.option('--trace', is_flag=True, default=False,
+              help='Log every sent, received and relayed message')
 @click.option('--stun-test', '-st', is_flag=True, default=False,
               help='Perform a STUN test')
 @click.option('--ipfs', is_flag=True, default=False,
               help='IPFS')
+@click.option('--ipfs-api', nargs=1, default=None,
+              help='Talk to the IPFS daemon through its HTTP API at HOST:PORT')
 @click.option('--dat', is_flag=True, default=False,
               help='Dat')
+@click.option('--dat-sharers', nargs=1, default=16,
+              help='Maximum number of running Dat sharing processes, 0 for unlimited')
+@click.option('--dat-ttl', nargs=1, type=float, default=300,
+              help='Stop Dat sharing processes unused for this long [s], 0 to keep them')
+@click.option('--local', is_flag=True, default=False,
+              help='Serve resources from a local store over HTTP (no external tools)')
+@click.option('--local-address', nargs=1, default='127.0.0.1:0',
+              help='HOST:PORT of the local resource server')
+@click.option('--bandwidth', '-bw', nargs=1, type=float, default=0,
+              help='Local resource server bandwidth per transfer [MB/s], 0 for unlimited')
+@click.option('--latency', '-lt', nargs=1, type=float, default=0,
+              help='Local resource server latency per transfer [ms]')
 @click.option('--connect', is_flag=True, default=False)
-def main(name, address, client, proxy_client, server, proxy_server, output_dir, log_dir,
-         tasks, size, timeout, stun_test, ipfs, dat, connect):
+@click.option('--transport', '-tr', type=click.Choice(sorted(TRANSPORTS)), default='threaded',
+              help='Network transport: thread per connection or a single event loop')
+@click.option('--relay', '-r', type=click.Choice(['raw', 'decode']), default='raw',
+              help='Forward relayed frames as-is or decode and re-encode them')
+@click.option('--encoding', '-e', type=click.Choice(sorted(ENCODINGS)), default='binary',
+              help='Message encoding')
+def main(name, address, client, proxy_client, server, proxy_server, output_dir, log_dir, tasks,
+         size, scenario, source, seed, content, cache_dir, cache_budget, link, concurrency,
+         pipeline, result_workers, clients, ramp_up, ramp_step, processes, pool_depth, pool_budget,
+         timeout, metrics_port, metrics_host, spans, profile, profile_interval, profile_rounds,
+         results, parquet, log_level, log_file, trace, stun_test, ipfs, ipfs_api, dat, dat_sharers,
+         dat_ttl, local, local_address, bandwidth, latency, connect, transport, relay, encoding):
+
+    logger.configure('trace' if trace else log_level, file_path=log_file)
+    transport = TRANSPORTS[transport]
 
-    assert (ipfs or dat) and not (ipfs and dat), "Please specify the IPFS or Dat flag"
+    if ipfs_api:
+        IPFSAPICommands.configure(ipfs_api)
+
+    if dat:
+        DatCommands.configure(max_processes=int(dat_sharers), ttl=dat_ttl)
+
+    if local:
+        LocalCommands.configure(local_address,
+                                directory=os.path.join(output_dir, 'local_store'),
+                                bandwidth=bandwidth * 1024 * 1024 or None,
+                                latency=latency / 1000.)
+
+    assert [ipfs, dat, local].count(True) == 1, "Please specify the IPFS, Dat or local flag"
+
+    assert source != SOURCE_URANDOM or seed is None, "The urandom source cannot be seeded"
+
+    factory = None
+
+    if scenario:
+        assert not pool_depth, "The resource pool cannot be combined with a scenario"
+        scenario = Scenario.load(scenario)
+
+    if content == 'warm':
+        cache = ResourceCache(cache_dir or os.path.join(output_dir, 'cache'),
+                              budget=int(cache_budget) * 1024 * 1024, link=link)
+    else:
+        cache = None
 
     if client or proxy_client:
 
         if ipfs:
-            cls = IPFSClientSession
+            cls = IPFSAPIClientSession if ipfs_api else IPFSClientSession
+        elif local:
+            cls = LocalClientSession
         else:
             cls = DatClientSession
 
         if proxy_client:
             proxy_client = (address, proxy_client)
 
-        logic = cls(name, address,
-                    output_dir, log_dir,
-                    int(tasks), int(size),
-                    proxy=proxy_client, connect=connect)
+        kwargs = dict(file_size=int(size),
+                      proxy=proxy_client, connect=connect,
+                      source=source, seed=seed, cache=cache, scenario=scenario,
+                      transport=transport, raw_relay=relay == 'raw',
+                      version=ENCODINGS[encoding],
+                      concurrency=int(concurrency),
+                      pipeline=int(pipeline))
+
+        if clients > 1:
+            factory = ClientFactory(cls, name, address, output_dir, log_dir,
+                                    int(tasks), **kwargs)
+        else:
+            logic = cls(name, address, output_dir, log_dir, int(tasks), **kwargs)
 
     elif server or proxy_server:
 
         if ipfs:
-            cls = IPFSServerSession
+            cls = IPFSAPIServerSession if ipfs_api else IPFSServerSession
+        elif local:
+            cls = LocalServerSession
         else:
             cls = DatServerSession
 
@@ -67,7 +233,13 @@ def main(name, address, client, proxy_client, server, proxy_server, output_dir,
         logic = cls(name, address,
                     output_dir, log_dir,
                     int(size),
-                    proxy=proxy_server, connect=connect)
+                    proxy=proxy_server, connect=connect,
+                    source=source, seed=seed, cache=cache, scenario=scenario,
+                    transport=transport, raw_relay=relay == 'raw',
+                    version=ENCODINGS[encoding],
+                    pool_depth=int(pool_depth),
+                    pool_budget=int(pool_budget) * 1024 * 1024,
+                    result_workers=int(result_workers))
 
     else:
         raise RuntimeError("Neither (proxy) client or (proxy) server mode specified")
@@ -75,8 +247,47 @@ def main(name, address, client, proxy_client, server, proxy_server, output_dir,
     if stun_test:
         perform_stun_test()
 
-    session = Monitor(logic, timeout=int(timeout))
-    session.start()
+    run = '{}_{}'.format(name, int(time.time()))
+    tracer = Tracer() if spans else None
+
+    if profile:
+        profiler = create_profiler(profile, log_dir, run, per_round=profile_rounds,
+                                   interval=profile_interval)
+    else:
+        profiler = None
+
+    if results != 'none':
+        sink = ResultsSink(log_dir, run, fmt=results, parquet=parquet)
+    else:
+        sink = None
+
+    if metrics_port:
+        exporter = MetricsExporter(int(metrics_port), host=metrics_host)
+        exporter.start()
+    else:
+        exporter = None
+
+    try:
+        if factory:
+            load = LoadGenerator(factory, clients, ramp_up=ramp_up, step=ramp_step,
+                                 processes=processes, timeout=int(timeout), sink=sink,
+                                 exporter=exporter, tracer=tracer)
+            # rounds are not shared by the clients; a single profile is written
+            if profiler:
+                profiler.start()
+            load.run()
+        else:
+            session = Monitor(logic, timeout=int(timeout), sink=sink, exporter=exporter,
+                              tracer=tracer, profiler=profiler)
+            session.start()
+    finally:
+        if exporter:
+            exporter.stop()
+        if tracer:
+            tracer.write(log_dir, run)
+        # started above for load runs; stopping is idempotent
+        if profiler:
+            profiler.stop()
 
 
 def perform_stun_test():
@@ -92,5 +303,48 @@ def perform_stun_test():
     print('External Port:', external_port)
 
 
+@cli.command('compare')
+@click.option('--baseline', '-b', multiple=True, required=True,
+              help='Results file or directory of the baseline runs (repeatable)')
+@click.option('--candidate', '-c', multiple=True, required=True,
+              help='Results file or directory of the runs to compare (repeatable)')
+@click.option('--by', type=click.Choice(GROUP_FIELDS), multiple=True,
+              help='Fields to group downloads by (default: {})'.format(', '.join(DEFAULT_GROUP)))
+@click.option('--iterations', nargs=1, type=int, default=None,
+              help='Bootstrap iterations (default: 1000, or 200 without numpy)')
+@click.option('--confidence', nargs=1, type=float, default=0.95,
+              help='Confidence level of the intervals')
+@click.option('--threshold', nargs=1, type=float, default=0.05,
+              help='Smallest relative change reported as a regression')
+@click.option('--min-samples', nargs=1, default=5,
+              help='Groups with fewer downloads on either side are not compared')
+@click.option('--seed', nargs=1, type=int, default=None,
+              help='Seed of the bootstrap resampling')
+@click.option('--output', '-o', nargs=1, default=None,
+              help='Write the comparison to a JSON file')
+def compare_runs(baseline, candidate, by, iterations, confidence, threshold, min_samples, seed,
+                 output):
+
+    base_runs = RunSet(by).load(baseline)
+    runs = RunSet(by).load(candidate)
+
+    for label, run_set in (('Baseline', base_runs), ('Candidate', runs)):
+        click.echo('{}: {} runs in {} files, {} failed'.format(
+            label, len(run_set.runs), run_set.files, len(run_set.failed)))
+
+    rows = compare(base_runs, runs, Bootstrap(iterations, confidence, seed=seed),
+                   threshold=threshold, min_samples=min_samples)
+    click.echo('\n' + format_comparison(rows, base_runs.by))
+
+    if output:
+        with open(output, 'wb') as f:
+            json.dump(rows, f, indent=2)
+
+    found = regressions(rows)
+    if found:
+        click.echo('{} significant regression(s)'.format(len(found)))
+        sys.exit(1)
+
+
 if __name__ == '__main__':
-    main()
+    cli()
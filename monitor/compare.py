@@ -0,0 +1,370 @@
+from __future__ import absolute_import
+
+import csv
+import json
+import math
+import os
+import random
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MB = 1024. * 1024.
+
+GROUP_FIELDS = ['backend', 'direction', 'size', 'peer']
+DEFAULT_GROUP = ['backend', 'direction', 'size']
+
+# name, statistic, whether a higher value is better
+METRICS = [
+    ('p50', ('percentile', 50), False),
+    ('p95', ('percentile', 95), False),
+    ('throughput', ('mean', None), True),
+]
+
+RESULT_EXTENSIONS = ('.parquet', '.jsonl', '.csv')
+
+
+class Sample(object):
+
+    # Download times and throughputs of a group, with the runs they came from
+
+    def __init__(self):
+        self.elapsed = []
+        self.throughput = []
+        self.runs = set()
+
+    def __len__(self):
+        return len(self.elapsed)
+
+    def add(self, run, elapsed, throughput):
+        self.runs.add(run)
+        self.elapsed.append(elapsed)
+        if throughput is not None:
+            self.throughput.append(throughput)
+
+    def extend(self, runs, elapsed, throughput):
+        self.runs.update(runs)
+        self.elapsed.extend(elapsed)
+        self.throughput.extend(t for t in throughput if t is not None)
+
+    def values(self, metric):
+        return self.throughput if metric == 'throughput' else self.elapsed
+
+
+class RunSet(object):
+
+    # Events of many runs, aggregated per group while they are read
+
+    def __init__(self, by=None):
+        self.by = list(by or DEFAULT_GROUP)
+        self.groups = OrderedDict()
+        self.summaries = OrderedDict()
+        self.files = 0
+
+    @property
+    def runs(self):
+        runs = set(self.summaries)
+        for sample in self.groups.itervalues():
+            runs.update(sample.runs)
+        return runs
+
+    @property
+    def failed(self):
+        return [run for run, summary in self.summaries.iteritems() if summary.get('exception')]
+
+    def load(self, paths):
+        for path in find_results(paths):
+            self.load_file(path)
+        return self
+
+    def load_file(self, path):
+        self.files += 1
+
+        if path.endswith('.parquet'):
+            self._add_columns(read_parquet(path, ['type', 'run', 'elapsed', 'throughput'] + self.by))
+        else:
+            for record in read_records(path):
+                if record.get('type') == 'summary':
+                    self.summaries[record.get('run')] = record
+                else:
+                    self._add(record)
+
+        # written next to the results in every format
+        summary_path = path.rsplit('.', 1)[0] + '_summary.json'
+        if os.path.exists(summary_path):
+            with open(summary_path, 'rb') as f:
+                summary = json.load(f)
+            self.summaries[summary.get('run')] = summary
+
+    def _add(self, record):
+        if record.get('type', 'download') != 'download' or record.get('elapsed') is None:
+            return
+
+        key = tuple(group_value(field, record.get(field)) for field in self.by)
+        sample = self.groups.get(key)
+        if sample is None:
+            sample = self.groups[key] = Sample()
+        sample.add(record.get('run'), record['elapsed'], record.get('throughput'))
+
+    def _add_columns(self, columns):
+        # as _add, a column at a time: rows are grouped by index and each
+        # group's values are added at once
+        count = len(columns['elapsed']) if 'elapsed' in columns else 0
+        types = columns.get('type')
+        elapsed = columns.get('elapsed')
+        rows = [i for i in xrange(count) if elapsed[i] is not None and
+                (types is None or types[i] == 'download')]
+
+        keys = []
+        for field in self.by:
+            values = columns.get(field) or [None] * count
+            if field == 'size':
+                keys.append([group_value(field, values[i]) for i in rows])
+            else:
+                keys.append([values[i] for i in rows])
+
+        indices = OrderedDict()
+        for key, i in zip(zip(*keys), rows):
+            indices.setdefault(key, []).append(i)
+
+        runs = columns.get('run') or [None] * count
+        throughput = columns.get('throughput') or [None] * count
+        for key, group in indices.iteritems():
+            sample = self.groups.get(key)
+            if sample is None:
+                sample = self.groups[key] = Sample()
+            sample.extend(set(runs[i] for i in group), [elapsed[i] for i in group],
+                          [throughput[i] for i in group])
+
+
+def find_results(paths):
+    # results files in the given paths; a Parquet copy is preferred over
+    # the JSONL / CSV file it was converted from
+    found = OrderedDict()
+
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = []
+            for root, _, files in os.walk(path):
+                candidates.extend(os.path.join(root, f) for f in sorted(files))
+        else:
+            candidates = [path]
+
+        for candidate in candidates:
+            name = os.path.basename(candidate)
+            base, extension = os.path.splitext(candidate)
+            if not name.startswith('results_') or extension not in RESULT_EXTENSIONS:
+                continue
+
+            current = found.get(base)
+            if current is None or RESULT_EXTENSIONS.index(extension) < \
+                    RESULT_EXTENSIONS.index(os.path.splitext(current)[1]):
+                found[base] = candidate
+
+    return found.values()
+
+
+def read_records(path):
+    with open(path, 'rb') as f:
+        if path.endswith('.csv'):
+            for record in csv.DictReader(f):
+                for field in ('started', 'finished', 'elapsed', 'throughput', 'size'):
+                    record[field] = float(record[field]) if record.get(field) else None
+                yield record
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def read_parquet(path, columns=None):
+    # the given columns that the file has, as lists
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        import pandas
+        frame = pandas.read_parquet(path)
+        return dict((c, frame[c].tolist()) for c in frame.columns
+                    if columns is None or c in columns)
+
+    if columns is not None:
+        names = pyarrow.parquet.read_schema(path).names
+        columns = [c for c in names if c in columns]
+    return pyarrow.parquet.read_table(path, columns=columns).to_pydict()
+
+
+def group_value(field, value):
+    if field == 'size':
+        return '{:g} MB'.format(round((value or 0) / MB, 1))
+    return value
+
+
+def percentile(values, q):
+    # linear interpolation, as numpy.percentile
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100.
+    low = int(math.floor(position))
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def statistic(values, stat):
+    kind, q = stat
+    if kind == 'percentile':
+        return percentile(values, q)
+    return sum(values) / float(len(values))
+
+
+class Bootstrap(object):
+
+    # Confidence intervals of the ratio of a statistic between two samples.
+    # Samples larger than `max_samples` are subsampled for resampling, which
+    # widens the interval rather than narrowing it. Without numpy, fewer
+    # iterations over smaller samples keep the comparison of thousands of
+    # runs within seconds.
+
+    def __init__(self, iterations=None, confidence=0.95, max_samples=None, seed=None):
+        self.iterations = iterations or (1000 if numpy else 200)
+        self.confidence = confidence
+        self.max_samples = max_samples or (5000 if numpy else 1000)
+        self.random = random.Random(seed)
+        self.numpy_random = numpy.random.RandomState(seed) if numpy else None
+
+    def ratio(self, baseline, candidate, stat):
+        base_value = statistic(baseline, stat)
+        value = statistic(candidate, stat)
+        ratio = value / base_value if base_value else None
+
+        if ratio is None:
+            return base_value, value, None, None, None
+
+        if numpy:
+            ratios = self._ratios_numpy(baseline, candidate, stat)
+        else:
+            ratios = self._ratios(baseline, candidate, stat)
+
+        if not ratios:
+            return base_value, value, ratio, None, None
+
+        alpha = (1 - self.confidence) / 2 * 100
+        low, high = percentile(ratios, alpha), percentile(ratios, 100 - alpha)
+        return base_value, value, ratio, low, high
+
+    def _subsample(self, values):
+        if len(values) <= self.max_samples:
+            return values
+        return self.random.sample(values, self.max_samples)
+
+    def _ratios(self, baseline, candidate, stat):
+        baseline, candidate = self._subsample(baseline), self._subsample(candidate)
+        rand = self.random.random
+        ratios = []
+
+        # indexing with random() is several times faster than random.choice
+        def resample(values):
+            size = len(values)
+            return [values[int(rand() * size)] for _ in xrange(size)]
+
+        for _ in xrange(self.iterations):
+            base_value = statistic(resample(baseline), stat)
+            if base_value:
+                ratios.append(statistic(resample(candidate), stat) / base_value)
+        return ratios
+
+    def _ratios_numpy(self, baseline, candidate, stat):
+        resampled = []
+
+        for values in (baseline, candidate):
+            values = numpy.asarray(self._subsample(values), dtype=float)
+            indexes = self.numpy_random.randint(0, len(values), (self.iterations, len(values)))
+            samples = values[indexes]
+
+            if stat[0] == 'percentile':
+                resampled.append(numpy.percentile(samples, stat[1], axis=1))
+            else:
+                resampled.append(samples.mean(axis=1))
+
+        base_values, values = resampled
+        valid = base_values != 0
+        return (values[valid] / base_values[valid]).tolist()
+
+
+def compare(baseline, candidate, bootstrap=None, threshold=0.05, min_samples=5):
+    # One row per group present in both run sets. A metric regresses when
+    # the confidence interval of its ratio excludes 1 and the ratio is more
+    # than `threshold` worse; improvements are flagged the same way.
+    bootstrap = bootstrap or Bootstrap()
+    rows = []
+
+    for key, base_sample in baseline.groups.iteritems():
+        sample = candidate.groups.get(key)
+        if sample is None:
+            continue
+
+        row = OrderedDict(zip(baseline.by, key))
+        row['baseline_runs'] = len(base_sample.runs)
+        row['candidate_runs'] = len(sample.runs)
+        row['baseline_count'] = len(base_sample)
+        row['candidate_count'] = len(sample)
+        row['metrics'] = OrderedDict()
+
+        for name, stat, higher_is_better in METRICS:
+            base_values, values = base_sample.values(name), sample.values(name)
+            if len(base_values) < min_samples or len(values) < min_samples:
+                continue
+
+            base_value, value, ratio, low, high = bootstrap.ratio(base_values, values, stat)
+            row['metrics'][name] = dict(baseline=base_value, candidate=value, ratio=ratio,
+                                        low=low, high=high,
+                                        verdict=verdict(ratio, low, high, higher_is_better,
+                                                        threshold))
+        rows.append(row)
+
+    return rows
+
+
+def verdict(ratio, low, high, higher_is_better, threshold):
+    if ratio is None or low is None:
+        return None
+
+    worse = high < 1 and ratio < 1 - threshold if higher_is_better \
+        else low > 1 and ratio > 1 + threshold
+    better = low > 1 and ratio > 1 + threshold if higher_is_better \
+        else high < 1 and ratio < 1 - threshold
+
+    if worse:
+        return 'regression'
+    elif better:
+        return 'improvement'
+    return None
+
+
+def regressions(rows):
+    return [(row, name) for row in rows for name, metric in row['metrics'].iteritems()
+            if metric['verdict'] == 'regression']
+
+
+def format_comparison(rows, by):
+    res = ''
+
+    for row in rows:
+        res += '{}  runs {} / {}, downloads {} / {}\n'.format(
+            ', '.join('{}={}'.format(f, row[f]) for f in by),
+            row['baseline_runs'], row['candidate_runs'],
+            row['baseline_count'], row['candidate_count'])
+
+        for name, metric in row['metrics'].iteritems():
+            unit = 'MB/s' if name == 'throughput' else 's'
+            if metric['low'] is None:
+                res += '  {:<10} {:>12.6f} -> {:>12.6f} {}\n'.format(
+                    name, metric['baseline'], metric['candidate'], unit)
+                continue
+            res += '  {:<10} {:>12.6f} -> {:>12.6f} {:<4} x{:.3f} [{:.3f}, {:.3f}] {}\n'.format(
+                name, metric['baseline'], metric['candidate'], unit, metric['ratio'],
+                metric['low'], metric['high'], (metric['verdict'] or '').upper())
+        res += '\n'
+
+    return res
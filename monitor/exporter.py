@@ -0,0 +1,198 @@
+from __future__ import absolute_import
+
+import BaseHTTPServer
+import SocketServer
+import threading
+import time
+
+from common.util import log
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'golem_resource'
+
+# upper bounds of the latency histogram buckets [s]
+LATENCY_BUCKETS = [.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _peer(value):
+    if isinstance(value, tuple):
+        return '{}:{}'.format(*value[:2])
+    return str(value)
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Family(object):
+
+    # One metric family in the Prometheus text exposition format
+
+    def __init__(self, name, kind, description):
+        self.name = '{}_{}'.format(PREFIX, name)
+        self.kind = kind
+        self.description = description
+        self.samples = []
+
+    def add(self, value, suffix='', **labels):
+        self.samples.append((suffix, labels, value))
+
+    def add_histogram(self, bounds, ranks, total, count, **labels):
+        for bound, rank in zip(bounds, ranks):
+            self.add(rank, '_bucket', le=_number(bound), **labels)
+        self.add(count, '_bucket', le='+Inf', **labels)
+        self.add(total, '_sum', **labels)
+        self.add(count, '_count', **labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+
+        for suffix, labels, value in self.samples:
+            label_str = ','.join('{}="{}"'.format(k, _escape(v))
+                                 for k, v in sorted(labels.iteritems()))
+            lines.append('{}{}{} {}'.format(self.name, suffix,
+                                            '{' + label_str + '}' if label_str else '',
+                                            _number(value)))
+        return '\n'.join(lines)
+
+
+class MetricsExporter(object):
+
+    # Serves the live state of the registered sessions over HTTP.
+    # Values are read when scraped; nothing is recorded on the hot path.
+
+    def __init__(self, port, host='127.0.0.1', buckets=None):
+        self.address = (host, port)
+        self.buckets = buckets or LATENCY_BUCKETS
+        self.sessions = []
+        self.started = time.time()
+
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def register(self, name, state, protocol=None):
+        with self._lock:
+            self.sessions = [s for s in self.sessions if s[0] != name]
+            self.sessions.append((name, state, protocol))
+
+    def start(self):
+        if self._thread:
+            return
+
+        self._server = MetricsServer(self.address, self)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs=dict(poll_interval=0.5))
+        self._thread.daemon = True
+        self._thread.start()
+        log('Serving metrics on http://{}:{}/metrics'.format(*self._server.server_address[:2]))
+
+    def stop(self):
+        if self._thread:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+            self._server.server_close()
+
+    def render(self):
+        families = self.collect()
+        return '\n'.join(f.render() for f in families) + '\n'
+
+    def collect(self):
+        now = time.time()
+
+        rounds = Family('rounds_total', 'counter', 'Completed rounds')
+        done = Family('done', 'gauge', 'Whether the session has finished')
+        heartbeat = Family('heartbeat_age_seconds', 'gauge', 'Time since the last heartbeat')
+        downloads = Family('downloads_total', 'counter', 'Completed downloads')
+        latency = Family('download_seconds', 'histogram', 'Download latency')
+        batches = Family('batch_seconds', 'histogram', 'Latency of a round of downloads')
+        transferred = Family('transferred_bytes_total', 'counter', 'Downloaded bytes')
+        peers = Family('peers', 'gauge', 'Connected peers')
+        received = Family('peer_received_messages_total', 'counter',
+                          'Messages received from a peer')
+        received_bytes = Family('peer_received_bytes_total', 'counter',
+                                'Bytes received from a peer')
+        relayed = Family('peer_relayed_messages_total', 'counter',
+                         'Messages from a peer relayed to other peers')
+        relayed_bytes = Family('peer_relayed_bytes_total', 'counter',
+                               'Bytes from a peer relayed to other peers')
+        uptime = Family('uptime_seconds', 'gauge', 'Time since the exporter was created')
+
+        uptime.add(now - self.started)
+
+        with self._lock:
+            sessions = list(self.sessions)
+
+        for name, state, protocol in sessions:
+            rounds.add(state.rounds, session=name)
+            done.add(int(bool(state.done)), session=name)
+            heartbeat.add(now - state.last_heartbeat, session=name)
+
+            for peer, ranks, total, count in state.downloads.histogram(self.buckets):
+                downloads.add(count, session=name, peer=_peer(peer))
+                latency.add_histogram(self.buckets, ranks, total, count,
+                                      session=name, peer=_peer(peer))
+
+            for peer, ranks, total, count in state.batches.histogram(self.buckets):
+                batches.add_histogram(self.buckets, ranks, total, count,
+                                      session=name, peer=_peer(peer))
+
+            for (backend, direction), size in sorted(state.transferred()):
+                transferred.add(size, session=name, backend=backend, direction=direction)
+
+            if protocol is None:
+                continue
+
+            connected = list(protocol.peer_manager)
+            peers.add(len(connected), session=name)
+
+            for peer in connected:
+                labels = dict(session=name, peer=_peer(peer.address), name=peer.name or '')
+                received.add(peer.messages, **labels)
+                received_bytes.add(peer.bytes, **labels)
+                relayed.add(peer.relayed, **labels)
+                relayed_bytes.add(peer.relayed_bytes, **labels)
+
+        return [uptime, rounds, done, heartbeat, downloads, latency, batches, transferred,
+                peers, received, received_bytes, relayed, relayed_bytes]
+
+
+class MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        try:
+            body = self.server.exporter.render()
+        except Exception as exc:
+            self.send_error(500, str(exc))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+class MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, exporter):
+        BaseHTTPServer.HTTPServer.__init__(self, address, MetricsRequestHandler)
+        self.exporter = exporter
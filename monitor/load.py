@@ -0,0 +1,226 @@
+from __future__ import absolute_import
+
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from collections import namedtuple
+
+from common.util import log
+from monitor.metrics import Metrics, format_stats
+from monitor.monitor import Monitor, MB
+
+ClientResult = namedtuple('ClientResult', ['name', 'started', 'finished', 'rounds', 'done', 'error',
+                                           'downloads', 'throughput', 'batches', 'size', 'events'])
+
+
+def ramp_up_schedule(clients, ramp_up=0., step=1):
+    # Start delays: clients are started in groups of `step`,
+    # the first group immediately and the last one after `ramp_up` s
+    step = max(1, step)
+    groups = (clients + step - 1) // step
+    interval = ramp_up / float(groups - 1) if groups > 1 else 0.
+    return [(i // step) * interval for i in xrange(clients)]
+
+
+class EventBuffer(list):
+
+    def write(self, event):
+        self.append(event)
+
+
+class ClientFactory(object):
+
+    # Picklable recipe for the client sessions, so that clients can be
+    # created in pool processes as well as in threads
+
+    def __init__(self, session_cls, name, address, output_dir, log_dir, n_tasks, **kwargs):
+        self.session_cls = session_cls
+        self.name = name
+        self.address = address
+        self.output_dir = output_dir
+        self.log_dir = log_dir
+        self.n_tasks = n_tasks
+        self.kwargs = kwargs
+        self.manage_daemon = False
+
+    def __call__(self, index):
+        name = '{}-{}'.format(self.name, index)
+        return self.session_cls(name, self.address,
+                                os.path.join(self.output_dir, name), self.log_dir,
+                                self.n_tasks, **self.kwargs)
+
+    def set_up(self):
+        # a single daemon is shared by all of the clients
+        commands = self.session_cls.commands
+        self.manage_daemon = self.session_cls.is_daemon and not commands.running()
+
+        if self.manage_daemon:
+            if not os.path.exists(self.log_dir):
+                os.makedirs(self.log_dir)
+            commands.start_daemon(self.log_dir)
+            commands.log_level()
+
+    def tear_down(self):
+        if self.manage_daemon:
+            self.session_cls.commands.stop_daemon()
+
+
+def run_client(factory, index, timeout, sink=None, exporter=None, tracer=None):
+    name = '{}-{}'.format(factory.name, index)
+    state = Monitor.State(timeout)
+    events = EventBuffer() if sink is None else None
+    state.sink = sink or events
+    started = time.time()
+    error = None
+
+    try:
+        monitor = Monitor(factory(index), timeout=timeout, report=False, exporter=exporter,
+                          tracer=tracer)
+        monitor.start(state)
+        error = monitor.error
+    except Exception as exc:
+        log('Client {} error: {}'.format(name, exc))
+        traceback.print_exc()
+        error = exc
+
+    return ClientResult(name, started, time.time(), state.rounds, state.done,
+                        str(error) if error else None,
+                        state.downloads, state.throughput, state.batches,
+                        sum(size for _, size in state.transferred()), events)
+
+
+class LoadGenerator(object):
+
+    def __init__(self, factory, clients, ramp_up=0., step=1, processes=0,
+                 timeout=120, sink=None, exporter=None, tracer=None):
+
+        self.factory = factory
+        self.clients = clients
+        self.ramp_up = ramp_up
+        self.step = step
+        self.processes = processes
+        self.timeout = timeout
+        self.sink = sink
+        # live metrics and spans are only available for clients running as threads
+        self.exporter = exporter
+        self.tracer = tracer
+
+        self.results = []
+        self._lock = threading.Lock()
+
+    def run(self):
+        delays = ramp_up_schedule(self.clients, self.ramp_up, self.step)
+        pool = multiprocessing.Pool(self.processes) if self.processes else None
+        threads, pending = [], []
+
+        if self.sink:
+            self.sink.start()
+        self.factory.set_up()
+        started = time.time()
+
+        try:
+            for index, delay in enumerate(delays):
+                wait = started + delay - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+
+                log('Starting client {} of {}'.format(index + 1, self.clients))
+
+                if pool:
+                    pending.append(pool.apply_async(run_client, (self.factory, index,
+                                                                 self.timeout)))
+                else:
+                    thread = threading.Thread(target=self._run_client, args=(index,))
+                    thread.daemon = True
+                    thread.start()
+                    threads.append(thread)
+
+            for thread in threads:
+                thread.join()
+            for result in pending:
+                self._add_result(result.get())
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            if pool:
+                pool.terminate()
+            self.factory.tear_down()
+
+            finished = time.time()
+            log('Load test result:\n{}'.format(self.report(started, finished)))
+
+            if self.sink:
+                self.sink.close(self.summary(started, finished))
+
+        return self.results
+
+    def _run_client(self, index):
+        self._add_result(run_client(self.factory, index, self.timeout, sink=self.sink,
+                                    exporter=self.exporter, tracer=self.tracer))
+
+    def _add_result(self, result):
+        if self.sink and result.events:
+            for event in result.events:
+                self.sink.write(event)
+
+        with self._lock:
+            self.results.append(result._replace(events=None))
+
+    def aggregate(self):
+        downloads, throughput, batches = Metrics(), Metrics(), Metrics()
+
+        for result in self.results:
+            downloads.merge(result.downloads)
+            throughput.merge(result.throughput)
+            batches.merge(result.batches)
+
+        return downloads, throughput, batches
+
+    def summary(self, started, finished):
+        downloads, throughput, batches = self.aggregate()
+        elapsed = finished - started
+        size = sum(r.size for r in self.results)
+
+        return dict(
+            clients=self.clients,
+            completed=sum(1 for r in self.results if r.done and not r.error),
+            elapsed=elapsed,
+            bytes=size,
+            aggregate_throughput=size / MB / elapsed if elapsed > 0 else None,
+            downloads=downloads.total.describe(),
+            throughput=throughput.total.describe(),
+            batches=batches.total.describe(),
+            per_client=[dict(name=r.name, rounds=r.rounds, done=r.done, error=r.error,
+                             elapsed=r.finished - r.started, bytes=r.size,
+                             downloads=r.downloads.total.describe(),
+                             throughput=r.throughput.total.describe())
+                        for r in sorted(self.results, key=lambda r: r.started)],
+        )
+
+    def report(self, started, finished):
+        summary = self.summary(started, finished)
+
+        res = ''
+        for client in summary['per_client']:
+            latency, throughput = client['downloads'], client['throughput']
+            res += '{:<16} rounds {:>4} downloads {:>5} p50 {:>9} s p95 {:>9} s {:>9} MB/s{}\n'.format(
+                client['name'], client['rounds'], latency.get('count', 0),
+                _fmt(latency.get('50%')), _fmt(latency.get('95%')),
+                _fmt(throughput.get('mean'), 2),
+                ' ERROR: {}'.format(client['error']) if client['error'] else '')
+
+        res += '\nClients {completed}/{clients} completed in {elapsed:.3f} s, ' \
+               '{mb:.2f} MB at {rate} MB/s\n'.format(mb=summary['bytes'] / MB,
+                                                     rate=_fmt(summary['aggregate_throughput'], 2),
+                                                     **summary)
+        res += '\nLatency:\n{}\n'.format(format_stats(summary['downloads']))
+        res += '\nThroughput per download (MB/s):\n{}\n'.format(format_stats(summary['throughput']))
+        return res
+
+
+def _fmt(value, precision=4):
+    return 'NaN' if value is None else '{:.{}f}'.format(value, precision)
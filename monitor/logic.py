@@ -1,7 +1,17 @@
+import os
 import time
 from abc import ABCMeta, abstractmethod
+from collections import namedtuple
 from contextlib import contextmanager
 
+from common.util import tree_size
+
+CLIENT_FETCH = 'client'
+SERVER_FETCH = 'server'
+
+DownloadEvent = namedtuple('DownloadEvent', ['peer', 'backend', 'hash', 'direction',
+                                             'started', 'finished', 'size'])
+
 
 class Logic(object):
 
@@ -26,13 +36,23 @@ class Logic(object):
 
 
 @contextmanager
-def timed_download(state, protocol):
+def timed_download(state, peer, backend, hash_entry, output_dir, direction):
+
+    started = time.time()
+    yield
+    finished = time.time()
+
+    # measured outside of the timed block
+    size = tree_size(output_dir) if os.path.exists(output_dir) else 0
+    state.record_download(DownloadEvent(peer, backend, hash_entry, direction,
+                                        started, finished, size))
+
+
+@contextmanager
+def timed_batch(state, peer):
 
     started = time.time()
     yield
     elapsed = time.time() - started
 
-    if protocol.address in state.downloads:
-        state.downloads[protocol.address].append(elapsed)
-    else:
-        state.downloads[protocol.address] = [elapsed]
+    state.batches.record(peer, elapsed)
@@ -0,0 +1,200 @@
+import math
+import threading
+from array import array
+from collections import OrderedDict
+
+PERCENTILES = [.01, .05, .1, .25, .5, .75, .9, .95, .99]
+
+
+class QuantileSketch(object):
+
+    # Logarithmically sized buckets: every quantile estimate is within
+    # `relative_accuracy` of the true value, in constant memory.
+
+    def __init__(self, relative_accuracy=0.01, min_value=1e-9):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+
+        self.counts = array('L')
+        self.key_offset = 0
+        self.zero_count = 0
+
+        self.count = 0
+        self.sum = 0.
+        self.sum_sq = 0.
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value, count=1):
+        if value < 0:
+            raise ValueError('Negative values are not supported: {}'.format(value))
+
+        self.count += count
+        self.sum += value * count
+        self.sum_sq += value * value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+        if value < self.min_value:
+            self.zero_count += count
+        else:
+            idx = self._index(self._key(value))
+            self.counts[idx] += count
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError('Cannot merge sketches of different accuracy')
+        if not other.count:
+            return
+
+        for i, count in enumerate(other.counts):
+            if count:
+                self.counts[self._index(other.key_offset + i)] += count
+
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_sq += other.sum_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return self.min
+
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen > rank:
+                value = 2 * self.gamma ** (self.key_offset + i) / (self.gamma + 1)
+                return max(self.min, min(self.max, value))
+
+        return self.max
+
+    def rank(self, value):
+        if value < self.min_value:
+            return self.zero_count if value >= 0 else 0
+
+        key = self._key(value)
+        end = min(len(self.counts), key - self.key_offset + 1)
+        return self.zero_count + sum(self.counts[:max(0, end)])
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return None
+        variance = (self.sum_sq - self.sum * self.sum / self.count) / (self.count - 1)
+        return math.sqrt(max(variance, 0.))
+
+    def describe(self, percentiles=None):
+        result = OrderedDict()
+        if not self.count:
+            return result
+
+        result['count'] = self.count
+        result['mean'] = self.mean
+        result['std'] = self.std
+        result['min'] = self.min
+        for q in percentiles or PERCENTILES:
+            result['{:g}%'.format(q * 100)] = self.quantile(q)
+        result['max'] = self.max
+        return result
+
+    def _key(self, value):
+        return int(math.ceil(math.log(value) / self.log_gamma))
+
+    def _index(self, key):
+        if not self.counts:
+            self.key_offset = key
+            self.counts.append(0)
+        elif key < self.key_offset:
+            self.counts = array('L', [0] * (self.key_offset - key)) + self.counts
+            self.key_offset = key
+        elif key >= self.key_offset + len(self.counts):
+            self.counts.extend([0] * (key - self.key_offset - len(self.counts) + 1))
+        return key - self.key_offset
+
+
+class Metrics(object):
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.total = QuantileSketch(relative_accuracy)
+        self.partial = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.total)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.partial
+
+    def __getitem__(self, key):
+        with self._lock:
+            return self.partial[key]
+
+    def items(self):
+        # a snapshot, as download threads may add keys meanwhile
+        with self._lock:
+            return self.partial.items()
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def record(self, key, value):
+        with self._lock:
+            if key not in self.partial:
+                self.partial[key] = QuantileSketch(self.relative_accuracy)
+            self.partial[key].add(value)
+            self.total.add(value)
+
+    def histogram(self, bounds):
+        # cumulative counts at each of the upper bounds, per key
+        with self._lock:
+            return [(key, [sketch.rank(b) for b in bounds], sketch.sum, sketch.count)
+                    for key, sketch in self.partial.iteritems()]
+
+    def merge(self, other):
+        items = other.items()
+        with self._lock:
+            for key, sketch in items:
+                if key not in self.partial:
+                    self.partial[key] = QuantileSketch(self.relative_accuracy)
+                self.partial[key].merge(sketch)
+            self.total.merge(other.total)
+
+
+def format_stats(stats):
+    if not stats:
+        return '{}'
+    width = max(len(k) for k in stats)
+    return '\n'.join('{:<{}} {:>14.6f}'.format(k, width, v) if v is not None
+                     else '{:<{}} {:>14}'.format(k, width, 'NaN')
+                     for k, v in stats.iteritems())
@@ -2,12 +2,15 @@ from __future__ import absolute_import
 
 import time
 import traceback
-from threading import Thread
-
-import pandas as pd
+from collections import defaultdict
+from threading import Lock, Thread
 
+from common.tracing import NULL_TRACER
 from common.util import log
 from monitor.logic import Logic
+from monitor.metrics import Metrics, format_stats
+
+MB = 1024. * 1024.
 
 
 class Monitor(object):
@@ -17,7 +20,13 @@ class Monitor(object):
         def __init__(self, timeout):
             self.last_heartbeat = time.time()
 
-            self.downloads = dict()
+            self.downloads = Metrics()
+            self.throughput = Metrics()
+            self.batches = Metrics()
+            self.bytes = defaultdict(int)
+            self.sink = None
+            self.tracer = NULL_TRACER
+            self._lock = Lock()
             self.rounds = 0
             self.timeout = timeout
 
@@ -31,40 +40,76 @@ class Monitor(object):
         def timed_out(self, timeout):
             return timeout > 0 and self.last_heartbeat + timeout <= time.time()
 
+        def record_download(self, event):
+            elapsed = event.finished - event.started
+
+            self.downloads.record(event.peer, elapsed)
+            with self._lock:
+                self.bytes[event.backend, event.direction] += event.size
+            if elapsed > 0:
+                self.throughput.record(event.peer, event.size / MB / elapsed)
+            if self.sink is not None:
+                self.sink.write(event)
+
         def new_round(self):
-            self.rounds += 1
+            with self._lock:
+                self.rounds += 1
+
+        def summary(self, error=None):
+            error = self.exception or error
+            return dict(
+                rounds=self.rounds,
+                done=self.done,
+                exception=str(error) if error else None,
+                downloads=self.downloads.total.describe(),
+                throughput=self.throughput.total.describe(),
+                batches=self.batches.total.describe(),
+                bytes=dict(('{}:{}'.format(*k), v) for k, v in self.transferred()),
+            )
 
-        def __repr__(self):
-            aggregated = []
-            partial = {}
+        def transferred(self):
+            with self._lock:
+                return self.bytes.items()
 
+        def __repr__(self):
+            res = "Total:\n{}\n".format(format_stats(self.downloads.total.describe()))
             for k, v in self.downloads.iteritems():
-                aggregated += v
-                partial[k] = pd.DataFrame(v)
-
-            res = "Total:\n{}\n".format(self.__stats(pd.DataFrame(aggregated)))
-            for k, v in partial.iteritems():
-                res += "\n{}:\n{}\n".format(k, self.__stats(v))
+                res += "\n{}:\n{}\n".format(k, format_stats(v.describe()))
+            res += "\nThroughput total (MB/s):\n{}\n".format(
+                format_stats(self.throughput.total.describe()))
+            for k, v in self.throughput.iteritems():
+                res += "\nThroughput {} (MB/s):\n{}\n".format(k, format_stats(v.describe()))
+            for (backend, direction), size in sorted(self.transferred()):
+                res += "\nTransferred {} {}: {:.2f} MB\n".format(backend, direction, size / MB)
+            for k, v in self.batches.iteritems():
+                res += "\nBatches {}:\n{}\n".format(k, format_stats(v.describe()))
             return res
 
-        @staticmethod
-        def __stats(data_frame):
-            if data_frame.empty:
-                return dict()
-            return data_frame.describe(
-                [.01, .05, .1, .25, .5, .75, .9, .95, .99]
-            )
-
-    def __init__(self, logic, timeout=120):
+    def __init__(self, logic, timeout=120, sink=None, report=True, exporter=None, tracer=None,
+                 profiler=None):
 
         assert_msg = 'Invalid logic class: {}'.format(logic.__class__.__name__)
         assert isinstance(logic, Logic), assert_msg
 
         self.logic = logic
         self.timeout = timeout
+        self.sink = sink
+        self.report = report
+        self.exporter = exporter
+        self.tracer = tracer
+        self.profiler = profiler
+        self.error = None
+
+    def start(self, state=None):
+        state = state or self.State(self.timeout)
+
+        if self.sink:
+            self.sink.start()
+            state.sink = self.sink
+        if self.tracer:
+            state.tracer = self.tracer
 
-    def start(self):
-        state = self.State(self.timeout)
+        error = None
 
         def job():
             try:
@@ -76,15 +121,23 @@ class Monitor(object):
             else:
                 state.done = True
 
-        self.logic.set_up(state)
+        if self.exporter:
+            protocol = self.logic if hasattr(self.logic, 'peer_manager') else None
+            self.exporter.register(getattr(self.logic, 'name', 'session'), state, protocol)
 
-        thread = Thread(target=job)
-        thread.daemon = True
-        thread.start()
+        if self.profiler:
+            self.profiler.start(lambda: state.rounds)
 
         try:
+            # servers keep serving from set_up until interrupted; the summary
+            # and the remaining results are written in either case
+            self.logic.set_up(state)
 
-            while not state.done and thread.is_alive:
+            thread = Thread(target=job)
+            thread.daemon = True
+            thread.start()
+
+            while not state.done and thread.is_alive():
                 if state.timed_out(state.timeout):
                     raise Exception('Test timed out after {} s'
                                     .format(state.timeout))
@@ -98,12 +151,25 @@ class Monitor(object):
 
         except Exception as exc:
             log("Test session exception: {}".format(exc))
+            error = exc
 
         finally:
             self.logic.tear_down()
 
+            if self.profiler:
+                self.profiler.stop()
+
             if state.exception:
                 log('Test exception: {}'.format(state.exception))
                 log(state.backtrace)
 
-            log('Test state result:\n{}'.format(state))
+            if self.report:
+                log('Test state result:\n{}'.format(state))
+                if state.tracer.enabled:
+                    log('Round breakdown:\n{}'.format(state.tracer.report()))
+
+            if self.sink:
+                self.sink.close(state.summary(error))
+
+            self.error = state.exception or error
+        return state
@@ -0,0 +1,277 @@
+from __future__ import absolute_import
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from collections import Counter
+
+from common.util import log
+
+PROFILE_CPROFILE = 'cprofile'
+PROFILE_SAMPLING = 'sampling'
+PROFILES = [PROFILE_CPROFILE, PROFILE_SAMPLING]
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                               code.co_firstlineno)
+
+
+def collapse(frame, root):
+    # 'root;outer;...;inner', as read by flamegraph.pl and speedscope
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.append(root)
+    return ';'.join(reversed(labels))
+
+
+def diff_stats(new, old):
+    # pstats entries: func -> (primitive calls, calls, tottime, cumtime, callers)
+    result = {}
+
+    for func, (cc, nc, tt, ct, callers) in new.iteritems():
+        if func not in old:
+            result[func] = (cc, nc, tt, ct, dict(callers))
+            continue
+
+        o_cc, o_nc, o_tt, o_ct, o_callers = old[func]
+        if nc == o_nc:
+            continue
+
+        delta = {}
+        for caller, value in callers.iteritems():
+            o_value = o_callers.get(caller)
+            if o_value is None:
+                delta[caller] = value
+            elif isinstance(value, tuple):
+                delta[caller] = tuple(v - o for v, o in zip(value, o_value))
+            else:
+                delta[caller] = value - o_value
+        result[func] = (cc - o_cc, nc - o_nc, tt - o_tt, ct - o_ct, delta)
+
+    return result
+
+
+class _Snapshot(object):
+
+    # pstats.Stats input that does not disable a running profiler
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class Profiler(object):
+
+    # Profiles every thread of the process. Session profiles are written
+    # when stopped; with `per_round`, a profile of each completed round is
+    # written as well, as reported by the `rounds` callable given to start.
+
+    __metaclass__ = ABCMeta
+
+    def __init__(self, log_dir, run, per_round=False, poll_interval=0.1):
+        self.log_dir = log_dir
+        self.run = run
+        self.per_round = per_round
+        self.poll_interval = poll_interval
+
+        self.rounds = None
+        self.last_round = None
+        self.started = None
+        self.written = []
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, rounds=None):
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+
+        self.rounds = rounds
+        self.last_round = rounds() if rounds else None
+        self.started = time.time()
+        self._stopped.clear()
+
+        # started first, so that it is not profiled itself
+        self._thread = threading.Thread(target=self._watch)
+        self._thread.daemon = True
+        self._thread.start()
+
+        self._start()
+
+    def stop(self):
+        if not self._thread:
+            return
+
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+        self._stop()
+        if self.per_round and self.rounds:
+            self._write_round(self.last_round)
+        self._write_session()
+        log('Profile of {:.3f} s written to {}'.format(time.time() - self.started,
+                                                       ', '.join(self.written[-2:])))
+
+    def path(self, suffix, extension):
+        name = '{}_profile{}.{}'.format(self.run, suffix, extension)
+        return os.path.join(self.log_dir, name)
+
+    def _watch(self):
+        while not self._stopped.wait(self.poll_interval):
+            self._poll()
+
+            if self.per_round and self.rounds:
+                current = self.rounds()
+                if current != self.last_round:
+                    self._write_round(self.last_round)
+                    self.last_round = current
+
+    def _poll(self):
+        pass
+
+    @abstractmethod
+    def _start(self):
+        pass
+
+    @abstractmethod
+    def _stop(self):
+        pass
+
+    @abstractmethod
+    def _write_round(self, round_number):
+        pass
+
+    @abstractmethod
+    def _write_session(self):
+        pass
+
+
+class CProfileProfiler(Profiler):
+
+    # A cProfile.Profile per thread: the current thread, and every thread
+    # started afterwards, enable their own profile on their first call
+
+    def __init__(self, log_dir, run, per_round=False, poll_interval=0.1):
+        super(CProfileProfiler, self).__init__(log_dir, run, per_round, poll_interval)
+        self.profiles = []
+        self.round_stats = {}
+        self._lock = threading.Lock()
+
+    def _start(self):
+        threading.setprofile(self._bootstrap)
+        self._enable()
+
+    def _stop(self):
+        threading.setprofile(None)
+        sys.setprofile(None)
+
+    def _bootstrap(self, *_):
+        if not self._stopped.is_set():
+            self._enable()
+        else:
+            sys.setprofile(None)
+
+    def _enable(self):
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        # replaces the bootstrap hook of this thread
+        profile.enable()
+
+    def stats(self):
+        merged = {}
+
+        with self._lock:
+            profiles = list(self.profiles)
+
+        for profile in profiles:
+            profile.snapshot_stats()
+            stats = pstats.Stats(_Snapshot(profile.stats))
+            for func, entry in stats.stats.iteritems():
+                if func in merged:
+                    merged[func] = pstats.add_func_stats(merged[func], entry)
+                else:
+                    merged[func] = entry
+        return merged
+
+    def _write_round(self, round_number):
+        current = self.stats()
+        self._dump(diff_stats(current, self.round_stats),
+                   self.path('_round{:04d}'.format(round_number), 'pstats'))
+        self.round_stats = current
+
+    def _write_session(self):
+        self._dump(self.stats(), self.path('', 'pstats'))
+
+    def _dump(self, stats, path):
+        if not stats:
+            return
+        result = pstats.Stats(_Snapshot(stats))
+        result.dump_stats(path)
+        self.written.append(path)
+
+
+class SamplingProfiler(Profiler):
+
+    # Snapshots the stacks of all threads every `interval` seconds;
+    # the overhead does not depend on the number of calls being made
+
+    def __init__(self, log_dir, run, per_round=False, interval=0.005):
+        super(SamplingProfiler, self).__init__(log_dir, run, per_round, interval)
+        self.samples = Counter()
+        self.round_samples = Counter()
+        self.count = 0
+
+    def _start(self):
+        self.samples.clear()
+        self.round_samples.clear()
+
+    def _stop(self):
+        pass
+
+    def _poll(self):
+        names = dict((t.ident, t.name) for t in threading.enumerate())
+        own = threading.current_thread().ident
+
+        for ident, frame in sys._current_frames().iteritems():
+            if ident != own:
+                self.round_samples[collapse(frame, names.get(ident, str(ident)))] += 1
+        self.count += 1
+
+    def _write_round(self, round_number):
+        samples, self.round_samples = self.round_samples, Counter()
+        self.samples.update(samples)
+        self._dump(samples, self.path('_round{:04d}'.format(round_number), 'collapsed'))
+
+    def _write_session(self):
+        self.samples.update(self.round_samples)
+        self.round_samples = Counter()
+        self._dump(self.samples, self.path('', 'collapsed'))
+        log('Profile: {} samples every {} s'.format(self.count, self.poll_interval))
+
+    def _dump(self, samples, path):
+        if not samples:
+            return
+        with open(path, 'wb') as f:
+            for stack, count in sorted(samples.iteritems()):
+                f.write('{} {}\n'.format(stack, count))
+        self.written.append(path)
+
+
+def create_profiler(mode, log_dir, run, per_round=False, interval=0.005):
+    if mode == PROFILE_CPROFILE:
+        return CProfileProfiler(log_dir, run, per_round)
+    elif mode == PROFILE_SAMPLING:
+        return SamplingProfiler(log_dir, run, per_round, interval)
+    raise ValueError('Unknown profile mode: {}'.format(mode))
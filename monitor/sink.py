@@ -0,0 +1,184 @@
+import csv
+import json
+import os
+import threading
+import time
+import traceback
+from Queue import Queue, Empty
+
+from common.util import log
+
+FORMAT_JSONL = 'jsonl'
+FORMAT_CSV = 'csv'
+FORMATS = [FORMAT_JSONL, FORMAT_CSV]
+
+EVENT_FIELDS = ['run', 'type', 'peer', 'backend', 'hash', 'direction',
+                'started', 'finished', 'elapsed', 'size', 'throughput']
+
+_CLOSE = object()
+
+
+def event_record(run, event):
+    elapsed = event.finished - event.started
+    peer = event.peer
+    if isinstance(peer, tuple):
+        peer = '{}:{}'.format(*peer)
+
+    return dict(
+        run=run,
+        type='download',
+        peer=peer,
+        backend=event.backend,
+        hash=event.hash,
+        direction=event.direction,
+        started=event.started,
+        finished=event.finished,
+        elapsed=elapsed,
+        size=event.size,
+        throughput=event.size / 1048576. / elapsed if elapsed > 0 else None,
+    )
+
+
+class ResultsSink(object):
+
+    # Download events are queued by the session threads and appended to
+    # the results file by a single writer thread, in batches.
+
+    def __init__(self, log_dir, run, fmt=FORMAT_JSONL, parquet=False,
+                 batch_size=100, flush_interval=1.):
+
+        if fmt not in FORMATS:
+            raise ValueError('Unknown results format: {}'.format(fmt))
+
+        self.run = run
+        self.fmt = fmt
+        self.parquet = parquet
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        base_path = os.path.join(log_dir, 'results_{}'.format(run))
+        self.file_path = '{}.{}'.format(base_path, fmt)
+        self.summary_path = '{}_summary.json'.format(base_path)
+        self.parquet_path = '{}.parquet'.format(base_path)
+
+        self._queue = Queue()
+        self._thread = None
+        self._file = None
+        self._writer = None
+
+    def start(self):
+        directory = os.path.dirname(self.file_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._file = open(self.file_path, 'ab')
+        if self.fmt == FORMAT_CSV:
+            self._writer = csv.DictWriter(self._file, EVENT_FIELDS)
+            if not self._file.tell():
+                self._writer.writeheader()
+
+        self._thread = threading.Thread(target=self._work)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, event):
+        self._queue.put(event_record(self.run, event))
+
+    def close(self, summary=None):
+        if not self._thread:
+            return
+
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        self._thread = None
+
+        if summary is not None:
+            self._write_summary(summary)
+
+        self._file.close()
+        log('Results written to {}'.format(self.file_path))
+
+        if self.parquet:
+            try:
+                self._write_parquet()
+            except Exception as exc:
+                log('Cannot write Parquet results: {}'.format(exc))
+
+    def _work(self):
+        closing = False
+
+        while not closing:
+            batch = []
+            deadline = time.time() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.time()))
+                except Empty:
+                    break
+                if item is _CLOSE:
+                    closing = True
+                    break
+                batch.append(item)
+
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as exc:
+                    log('Cannot write results: {}'.format(exc))
+                    traceback.print_exc()
+
+    def _write_batch(self, batch):
+        if self.fmt == FORMAT_CSV:
+            self._writer.writerows(batch)
+        else:
+            self._file.write(''.join(json.dumps(record) + '\n' for record in batch))
+        self._file.flush()
+
+    def _write_summary(self, summary):
+        record = dict(summary, run=self.run, type='summary')
+
+        if self.fmt == FORMAT_JSONL:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+
+        with open(self.summary_path, 'wb') as f:
+            json.dump(record, f, indent=2)
+
+    def _write_parquet(self):
+        columns = dict((field, []) for field in EVENT_FIELDS)
+
+        for record in self._read_events():
+            for field in EVENT_FIELDS:
+                columns[field].append(record.get(field))
+
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            import pandas
+            pandas.DataFrame(columns, columns=EVENT_FIELDS).to_parquet(self.parquet_path)
+        else:
+            table = pyarrow.Table.from_arrays([pyarrow.array(columns[f]) for f in EVENT_FIELDS],
+                                              EVENT_FIELDS)
+            pyarrow.parquet.write_table(table, self.parquet_path)
+
+        log('Results written to {}'.format(self.parquet_path))
+
+    def _read_events(self):
+        with open(self.file_path, 'rb') as f:
+            if self.fmt == FORMAT_CSV:
+                for record in csv.DictReader(f):
+                    yield self._parse_csv(record)
+            else:
+                for line in f:
+                    record = json.loads(line)
+                    if record.get('type') == 'download':
+                        yield record
+
+    @staticmethod
+    def _parse_csv(record):
+        for field in ('started', 'finished', 'elapsed', 'throughput'):
+            record[field] = float(record[field]) if record[field] else None
+        record['size'] = int(record['size'])
+        return record
@@ -0,0 +1,181 @@
+import binascii
+import struct
+
+import jsonpickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+VERSION_JSON = '1'
+VERSION_BINARY = '2'
+VERSION_MSGPACK = '3'
+
+ENCODINGS = {
+    'json': VERSION_JSON,
+    'binary': VERSION_BINARY,
+    'msgpack': VERSION_MSGPACK,
+}
+
+HASH_RAW = 0
+HASH_HEX = 1
+
+# set on the hash kind byte when a round id follows
+ROUND_FLAG = 0x80
+
+COUNT_STRUCT = struct.Struct('!I')
+HASH_STRUCT = struct.Struct('!BH')
+ROUND_STRUCT = struct.Struct('!I')
+
+HEX_DIGITS = frozenset('0123456789abcdef')
+
+
+def encode_hash(value):
+    value = str(value)
+
+    # base58 IPFS hashes ('Qm...') are told apart by their first character,
+    # without raising from unhexlify for each of them
+    if len(value) % 2 == 0 and value[:1] in HEX_DIGITS:
+        try:
+            data = binascii.unhexlify(value)
+            if binascii.hexlify(data) == value:
+                return HASH_HEX, data
+        except (TypeError, binascii.Error):
+            pass
+
+    return HASH_RAW, value
+
+
+def decode_hash(kind, data):
+    if kind == HASH_HEX:
+        return binascii.hexlify(data)
+    elif kind == HASH_RAW:
+        return data
+    raise ValueError('Unknown hash encoding: {}'.format(kind))
+
+
+def pack_hashes(hashes):
+    pack = HASH_STRUCT.pack
+    parts = [COUNT_STRUCT.pack(len(hashes))]
+
+    for value in hashes:
+        kind, data = encode_hash(value)
+        parts.append(pack(kind, len(data)))
+        parts.append(data)
+    return ''.join(parts)
+
+
+def unpack_hash(content, offset=0):
+    kind, length = HASH_STRUCT.unpack_from(content, offset)
+    start = offset + HASH_STRUCT.size
+    end = start + length
+    return decode_hash(kind, content[start:end]), end
+
+
+def dumps_hash(value, version, round_id=None):
+    if version == VERSION_JSON:
+        value = str(value)
+        return value if round_id is None else '{} {}'.format(value, round_id)
+    elif version == VERSION_MSGPACK:
+        fields = encode_hash(value) + ((round_id,) if round_id is not None else ())
+        return _msgpack().packb(fields, use_bin_type=True)
+
+    kind, data = encode_hash(value)
+    if round_id is None:
+        return chr(kind) + data
+    return chr(kind | ROUND_FLAG) + ROUND_STRUCT.pack(round_id) + data
+
+
+def loads_hash(content, version):
+    return loads_hash_round(content, version)[0]
+
+
+def loads_hash_round(content, version):
+    if version == VERSION_JSON:
+        fields = str(content).split()
+        return fields[0], int(fields[1]) if len(fields) > 1 else None
+    elif version == VERSION_MSGPACK:
+        fields = _msgpack().unpackb(content, raw=True)
+        return decode_hash(*fields[:2]), fields[2] if len(fields) > 2 else None
+
+    kind = ord(content[0])
+    if kind & ROUND_FLAG:
+        round_id, = ROUND_STRUCT.unpack_from(content, 1)
+        return decode_hash(kind & ~ROUND_FLAG, content[1 + ROUND_STRUCT.size:]), round_id
+    return decode_hash(kind, content[1:]), None
+
+
+def dumps_hashes(hashes, version, round_id=None):
+    if version == VERSION_JSON:
+        if round_id is not None:
+            return jsonpickle.dumps(dict(hashes=hashes, round=round_id))
+        return jsonpickle.dumps(hashes)
+    elif version == VERSION_MSGPACK:
+        encoded = [encode_hash(h) for h in hashes]
+        if round_id is not None:
+            encoded = {'hashes': encoded, 'round': round_id}
+        return _msgpack().packb(encoded, use_bin_type=True)
+
+    content = pack_hashes(hashes)
+    if round_id is not None:
+        content += ROUND_STRUCT.pack(round_id)
+    return content
+
+
+def loads_hashes(content, version):
+    return loads_hashes_round(content, version)[0]
+
+
+def loads_hashes_round(content, version):
+    if version == VERSION_JSON:
+        decoded = jsonpickle.loads(content)
+        if isinstance(decoded, dict):
+            return decoded['hashes'], decoded['round']
+        return decoded, None
+    elif version == VERSION_MSGPACK:
+        decoded = _msgpack().unpackb(content, raw=True)
+        round_id = None
+        if isinstance(decoded, dict):
+            decoded, round_id = decoded['hashes'], decoded['round']
+        return [decode_hash(kind, data) for kind, data in decoded], round_id
+
+    count, = COUNT_STRUCT.unpack_from(content)
+    offset = COUNT_STRUCT.size
+    hashes = []
+
+    for _ in xrange(count):
+        value, offset = unpack_hash(content, offset)
+        hashes.append(value)
+
+    # a trailing round id is optional
+    if len(content) >= offset + ROUND_STRUCT.size:
+        round_id, = ROUND_STRUCT.unpack_from(content, offset)
+        return hashes, round_id
+    return hashes, None
+
+
+def dumps_round(round_id, version):
+    if round_id is None:
+        return ''
+    elif version == VERSION_JSON:
+        return str(round_id)
+    elif version == VERSION_MSGPACK:
+        return _msgpack().packb(round_id)
+    return ROUND_STRUCT.pack(round_id)
+
+
+def loads_round(content, version):
+    if not content:
+        return None
+    elif version == VERSION_JSON:
+        return int(content)
+    elif version == VERSION_MSGPACK:
+        return _msgpack().unpackb(content, raw=True)
+    return ROUND_STRUCT.unpack_from(content)[0]
+
+
+def _msgpack():
+    if not msgpack:
+        raise RuntimeError('msgpack encoding requires the msgpack package')
+    return msgpack
@@ -0,0 +1,6 @@
+class ProtocolError(Exception):
+    pass
+
+
+class ProtocolVersionError(ProtocolError):
+    pass
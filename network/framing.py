@@ -0,0 +1,97 @@
+from collections import namedtuple
+
+from errors import ProtocolError, ProtocolVersionError
+from message import HEADER_STRUCTS
+
+BUFFER_SIZE = 256 * 1024
+
+Frame = namedtuple('Frame', ['version', 'msg_id', 'src', 'dst', 'content', 'data'])
+
+
+class FrameDecoder(object):
+
+    # Frames reference the decoder's buffer: their memoryviews remain valid
+    # only until the next call to recv_from / feed.
+
+    def __init__(self, size=BUFFER_SIZE):
+        self.size = size
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.needed = 0
+
+    def __iter__(self):
+        return self.frames()
+
+    def __len__(self):
+        return self.end - self.start
+
+    def recv_from(self, sock):
+        self._reserve()
+        received = sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+    def feed(self, data):
+        self.needed = max(self.needed, len(self) + len(data))
+        self._reserve()
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def frames(self):
+        view = self.view
+
+        while self.end > self.start:
+
+            start = self.start
+            header = HEADER_STRUCTS.get(chr(self.buffer[start]))
+            if not header:
+                raise ProtocolVersionError('Version {!r} not supported'
+                                           .format(chr(self.buffer[start])))
+
+            header_end = start + header.size
+            if header_end > self.end:
+                self.needed = header.size
+                return
+
+            version, msg_id, src_len, dst_len, content_len = \
+                header.unpack_from(self.buffer, start)
+
+            if min(src_len, dst_len, content_len) < 0:
+                raise ProtocolError('Invalid message header')
+
+            src_end = header_end + src_len
+            dst_end = src_end + dst_len
+            end = dst_end + content_len
+
+            if end > self.end:
+                self.needed = end - start
+                return
+
+            self.start = end
+            self.needed = 0
+
+            yield Frame(version, msg_id,
+                        view[header_end:src_end].tobytes(),
+                        view[src_end:dst_end].tobytes(),
+                        view[dst_end:end],
+                        view[start:end])
+
+    def _reserve(self):
+        pending = self.end - self.start
+        capacity = max(self.size, self.needed)
+
+        if capacity > len(self.buffer) or (not pending and capacity < len(self.buffer)):
+            buf = bytearray(capacity)
+            buf[:pending] = self.view[self.start:self.end]
+            self.buffer = buf
+            self.view = memoryview(buf)
+        elif self.start and (self.start == self.end or
+                             len(self.buffer) - self.end < self.size // 4 or
+                             len(self.buffer) - self.start < self.needed):
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+        else:
+            return
+
+        self.start, self.end = 0, pending
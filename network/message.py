@@ -1,15 +1,28 @@
 import struct
 from collections import namedtuple
 
-import jsonpickle
+from encoding import VERSION_JSON, VERSION_BINARY, VERSION_MSGPACK, \
+    dumps_hash, loads_hash, loads_hash_round, dumps_hashes, loads_hashes_round, \
+    dumps_round, loads_round
 
 SHORT_LEN = 65535
 
-VERSION = '1'
-HEADER_STRUCT_FMT = '!chhhh'
+VERSION = VERSION_BINARY
+VERSIONS = (VERSION_JSON, VERSION_BINARY, VERSION_MSGPACK)
+
+HEADER_STRUCT_FMT = '!cHHHI'
 HEADER_STRUCT = struct.Struct(HEADER_STRUCT_FMT)
 HEADER_SIZE = HEADER_STRUCT.size
 
+LEGACY_HEADER_STRUCT_FMT = '!chhhh'
+LEGACY_HEADER_STRUCT = struct.Struct(LEGACY_HEADER_STRUCT_FMT)
+
+HEADER_STRUCTS = {
+    VERSION_JSON: LEGACY_HEADER_STRUCT,
+    VERSION_BINARY: HEADER_STRUCT,
+    VERSION_MSGPACK: HEADER_STRUCT,
+}
+
 
 MessageWrapper = namedtuple('MessageWrapper', ['msg', 'src', 'dst'])
 
@@ -17,32 +30,31 @@ MessageWrapper = namedtuple('MessageWrapper', ['msg', 'src', 'dst'])
 class Message(object):
     ID = 0
 
-    def pack(self, src, dst=''):
+    def pack(self, src, dst='', version=VERSION):
         src = str(src) or ''
         dst = str(dst) or ''
 
-        serialized = str(self.serialize())
-        content_len = len(str(serialized))
-        src_len = len(src)
-        dst_len = len(dst)
-
-        header = struct.Struct('{}{}s{}s{}s'.format(HEADER_STRUCT_FMT,
-                                                    src_len, dst_len,
-                                                    content_len))
-        return header.pack(VERSION, self.ID,
-                           src_len, dst_len, content_len,
-                           src, dst, serialized)
+        serialized = str(self.serialize(version))
+        header = HEADER_STRUCTS[version].pack(version, self.ID,
+                                              len(src), len(dst),
+                                              len(serialized))
+        return ''.join((header, src, dst, serialized))
 
     @staticmethod
     def unpack_header(data):
+        version = data[0]
+        # bytearray buffers index to ints
+        if isinstance(version, int):
+            version = chr(version)
+        header = HEADER_STRUCTS[version]
         version, msg_id, src_len, dst_len, content_len = \
-            struct.unpack(HEADER_STRUCT_FMT, data[:HEADER_SIZE])
+            header.unpack_from(data)
         return version, msg_id, src_len, dst_len, content_len
 
-    def serialize(self):
+    def serialize(self, version=VERSION):
         return ''
 
-    def deserialize(self, content):
+    def deserialize(self, content, version=VERSION):
         pass
 
 
@@ -53,10 +65,10 @@ class Hello(Message):
         super(Hello, self).__init__()
         self.name = name
 
-    def deserialize(self, name):
+    def deserialize(self, name, version=VERSION):
         self.name = str(name).strip()
 
-    def serialize(self):
+    def serialize(self, version=VERSION):
         return self.name
 
 
@@ -71,44 +83,74 @@ class Address(Message):
         super(Address, self).__init__()
         self.address = address
 
-    def deserialize(self, content):
-        self.address = str(content).strip()
+    def deserialize(self, content, version=VERSION):
+        self.address = loads_hash(content, version)
 
-    def serialize(self):
-        return self.address
+    def serialize(self, version=VERSION):
+        return dumps_hash(self.address, version)
 
 
 class GetResources(Message):
     ID = 20
 
+    def __init__(self, round_id=None):
+        super(GetResources, self).__init__()
+        self.round_id = round_id
+
+    def deserialize(self, content, version=VERSION):
+        self.round_id = loads_round(content, version)
+
+    def serialize(self, version=VERSION):
+        return dumps_round(self.round_id, version)
+
 
 class Resources(Message):
     ID = 21
 
-    def __init__(self, hashes):
+    def __init__(self, hashes, round_id=None):
         super(Resources, self).__init__()
         self.hashes = hashes
+        self.round_id = round_id
 
-    def deserialize(self, content):
+    def deserialize(self, content, version=VERSION):
+        self.round_id = None
         if content:
-            self.hashes = jsonpickle.loads(content)
+            self.hashes, self.round_id = loads_hashes_round(content, version)
 
-    def serialize(self):
-        return jsonpickle.dumps(self.hashes)
+    def serialize(self, version=VERSION):
+        return dumps_hashes(self.hashes, version, self.round_id)
 
 
 class Result(Message):
     ID = 30
 
-    def __init__(self, result_hash):
+    def __init__(self, result_hash, round_id=None):
         super(Result, self).__init__()
         self.result_hash = result_hash
+        self.round_id = round_id
+
+    def deserialize(self, content, version=VERSION):
+        self.result_hash, self.round_id = loads_hash_round(content, version)
+
+    def serialize(self, version=VERSION):
+        return dumps_hash(self.result_hash, version, self.round_id)
+
+
+class ResultAck(Message):
+    ID = 31
+
+    # Sent once the server is done fetching a result
+
+    def __init__(self, result_hash, round_id=None):
+        super(ResultAck, self).__init__()
+        self.result_hash = result_hash
+        self.round_id = round_id
 
-    def deserialize(self, content):
-        self.result_hash = str(content).strip()
+    def deserialize(self, content, version=VERSION):
+        self.result_hash, self.round_id = loads_hash_round(content, version)
 
-    def serialize(self):
-        return self.result_hash
+    def serialize(self, version=VERSION):
+        return dumps_hash(self.result_hash, version, self.round_id)
 
 
 def _collect_message_classes():
@@ -1,25 +1,19 @@
-import errno
 import socket
+import threading
 import time
-import traceback
 from abc import abstractmethod, ABCMeta
-from threading import Thread
 
 import select
 
-from message import VERSION, HEADER_SIZE, Message, MESSAGES, Resources, Address, GetResources, Result, Hello, \
-    MessageWrapper, GetAddress
+from errors import ProtocolError, ProtocolVersionError
+from message import VERSION, VERSIONS, MESSAGES, Message, Resources, Address, GetResources, Result, Hello, \
+    MessageWrapper, GetAddress, ResultAck
+from transport import ThreadedTransport, WOULD_BLOCK
+from common.logger import logger
+from common.tracing import NULL_TRACER
 from common.util import log
 
 
-class ProtocolError(Exception):
-    pass
-
-
-class ProtocolVersionError(ProtocolError):
-    pass
-
-
 def address_from_string(string):
     port_idx = string.rfind(':')
     address, port = string[:port_idx], int(string[port_idx + 1:])
@@ -27,21 +21,94 @@ def address_from_string(string):
     return address, port
 
 
+class Peer(object):
+
+    __slots__ = ('sock', 'address', 'name', 'names', 'messages', 'bytes',
+                 'relayed', 'relayed_bytes', 'connected', 'last_seen')
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.name = None
+        # a proxy connection carries the names of all of the peers behind it
+        self.names = []
+
+        self.messages = 0
+        self.bytes = 0
+        self.relayed = 0
+        self.relayed_bytes = 0
+        self.connected = self.last_seen = time.time()
+
+    def add_name(self, name):
+        if name not in self.names:
+            self.names.append(name)
+        self.name = name
+
+    def seen(self, size):
+        self.messages += 1
+        self.bytes += size
+        self.last_seen = time.time()
+
+    def relay(self, size):
+        self.relayed += 1
+        self.relayed_bytes += size
+
+
 class PeerManager(object):
 
+    # Lookups are plain dict reads and do not take the lock; registration
+    # and removal keep the three indexes consistent under the lock. Peer
+    # counters are only updated by the thread that reads from the peer.
+
     def __init__(self):
         self.peers = dict()
         self.names = dict()
-
-    def register(self, sock, name):
-        address = sock.getpeername()
-        self.peers[address] = (name, sock)
-        self.names[name] = (address, sock)
-
-    def unregister(self, address=None):
-        sock, name = self.peers.pop(address, (None, None))
-        self.names.pop(name, None)
-        return sock, name
+        self.socks = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.socks)
+
+    def __iter__(self):
+        return iter(self.socks.values())
+
+    def register(self, sock, name, address=None):
+        with self._lock:
+            peer = self.socks.get(sock)
+            if not peer:
+                peer = Peer(sock, address or sock.getpeername())
+                self.socks[sock] = peer
+                self.peers[peer.address] = peer
+
+            peer.add_name(name)
+            self.names[name] = peer
+        return peer
+
+    def unregister(self, address=None, sock=None):
+        with self._lock:
+            peer = self.socks.get(sock) if sock is not None else None
+            peer = peer or self.peers.get(address)
+            if not peer:
+                return None, None
+
+            self.socks.pop(peer.sock, None)
+            if self.peers.get(peer.address) is peer:
+                del self.peers[peer.address]
+            for name in peer.names:
+                if self.names.get(name) is peer:
+                    del self.names[name]
+
+        return peer.sock, peer.name
+
+    def seen(self, sock, size):
+        peer = self.socks.get(sock)
+        if peer:
+            peer.seen(size)
+
+    def relayed(self, sock, size):
+        peer = self.socks.get(sock)
+        if peer:
+            peer.relay(size)
 
     def contains_address(self, address):
         return address in self.peers
@@ -49,20 +116,33 @@ class PeerManager(object):
     def contains_name(self, name):
         return name in self.names
 
+    def contains_sock(self, sock):
+        return sock in self.socks
+
     def get(self, address):
-        return self.peers.get(address, (None, None))
+        peer = self.peers.get(address)
+        return (peer.name, peer.sock) if peer else (None, None)
 
     def get_by_name(self, name):
-        return self.names.get(name, (None, None))
+        peer = self.names.get(name)
+        return (peer.address, peer.sock) if peer else (None, None)
+
+    def get_by_sock(self, sock):
+        return self.socks.get(sock)
 
 
 class Protocol(object):
 
     __metaclass__ = ABCMeta
 
-    def __init__(self, name, address, proxy=None):
+    def __init__(self, name, address, proxy=None, transport=None, raw_relay=True,
+                 version=VERSION):
         self.messages = {c.ID: c for c in MESSAGES}
         self.peer_manager = PeerManager()
+        self.transport = (transport or ThreadedTransport)(self)
+        self.raw_relay = raw_relay
+        self.version = version
+        self.tracer = NULL_TRACER
 
         self.name = name
         self.address = address_from_string(address)
@@ -76,6 +156,7 @@ class Protocol(object):
 
     def stop(self):
         self.working = False
+        self.transport.stop()
 
     @abstractmethod
     def heartbeat(self):
@@ -84,8 +165,8 @@ class Protocol(object):
     def on_connect(self, protocol, conn):
         self.send(conn, Hello(self.name))
 
-    def on_disconnect(self, address):
-        self.peer_manager.unregister(address)
+    def on_disconnect(self, address, conn=None):
+        self.peer_manager.unregister(address, conn)
 
     def on_message(self, protocol, sock, msg_wrapper):
         msg = msg_wrapper.msg
@@ -100,7 +181,7 @@ class Protocol(object):
                 self.peer_manager.register(sock, msg.name)
                 result = True
 
-        elif not self.peer_manager.contains_address(sock.getpeername()):
+        elif not self.peer_manager.contains_sock(sock):
             raise ProtocolError("Unknown peer: {}".format(protocol.address))
 
         return result
@@ -109,10 +190,20 @@ class Protocol(object):
         if not dst:
             dst = self.proxy_peer
         if not dst:
-            _, dst = self.peer_manager.get(conn.getpeername())
-
-        log('>> send {} to {}'.format(msg.__class__.__name__, dst))
-        return self._sendall(conn, msg.pack(src=self.name, dst=dst or ''))
+            peer = self.peer_manager.get_by_sock(conn)
+            dst = peer.name if peer else None
+
+        if logger.tracing:
+            logger.trace('>> send {} to {}', msg.__class__.__name__, dst)
+        if not self.tracer.enabled:
+            return self.transport.sendall(conn, msg.pack(src=self.name, dst=dst or '',
+                                                         version=self.version))
+
+        started = time.time()
+        result = self.transport.sendall(conn, msg.pack(src=self.name, dst=dst or '',
+                                                       version=self.version))
+        self._trace('send', started, msg, dst=dst)
+        return result
 
     def relay(self, conn, msg_wrapper):
         msg = msg_wrapper.msg
@@ -124,126 +215,97 @@ class Protocol(object):
             if not sock:
                 raise ProtocolError('Unknown peer: {}'.format(dst))
 
-            log('>> relay {} from {} to {}'.format(msg.__class__.__name__, src, dst))
-            self._sendall(sock, msg.pack(src=src, dst=dst))
+            if logger.tracing:
+                logger.trace('>> relay {} from {} to {}', msg.__class__.__name__, src, dst)
+            data = msg.pack(src=src, dst=dst, version=self.version)
+            self.transport.sendall(sock, data)
+            self.peer_manager.relayed(conn, len(data))
             return True
 
-    def receive(self, conn):
-        data = self._receive(conn, HEADER_SIZE)
+    def relay_frame(self, conn, frame):
+        src = frame.src
+        dst = frame.dst
 
-        if len(data) == 0:
-            raise ProtocolError('Connection terminated by other side')
-        elif len(data) < HEADER_SIZE:
-            raise ProtocolError('Invalid message header of length {}: |{}|'
-                                .format(len(data), data))
+        if frame.msg_id != Hello.ID and src != self.name and dst and dst != self.name:
+            _, sock = self.peer_manager.get_by_name(dst)
+            if not sock:
+                raise ProtocolError('Unknown peer: {}'.format(dst))
+
+            if logger.tracing:
+                cls = self.messages.get(frame.msg_id, Message)
+                logger.trace('>> relay {} from {} to {}', cls.__name__, src, dst)
+            self.transport.forward(sock, frame.data)
+            self.peer_manager.relayed(conn, len(frame.data))
+            return True
+
+    def on_frame(self, conn, frame):
+        self.peer_manager.seen(conn, len(frame.data))
+        started = time.time() if self.tracer.enabled else None
+
+        if self.raw_relay:
+            if self.relay_frame(conn, frame):
+                if started:
+                    self.tracer.record('relay', started, time.time(), self.name,
+                                       src=frame.src, dst=frame.dst)
+                self.heartbeat()
+                return
+            self.transport.flush_forwarded()
+
+        wrapper = self.to_message_wrapper(frame.version, frame.msg_id,
+                                          frame.src, frame.dst,
+                                          frame.content.tobytes())
+        if started:
+            self._trace('receive', started, wrapper.msg, src=frame.src)
+        self.on_message(self, conn, wrapper)
+
+    def _trace(self, name, started, msg, **args):
+        # within a session span, the span's session and round are inherited
+        if self.tracer.active():
+            self.tracer.record(name, started, time.time(), message=msg.__class__.__name__, **args)
+        else:
+            self.tracer.record(name, started, time.time(), self.name,
+                               message=msg.__class__.__name__,
+                               message_round=getattr(msg, 'round_id', None), **args)
 
-        version, msg_id, src_len, dst_len, data_len = Message.unpack_header(data)
-        src = self._receive_len(conn, src_len)
-        dst = self._receive_len(conn, dst_len)
-        content = self._receive_len(conn, data_len)
+    def to_message_wrapper(self, version, msg_id, src, dst, content):
 
         wrapper = MessageWrapper(
             self.to_message(version, msg_id, content),
             src, dst
         )
 
-        log('>> receive {} from {} to {}'.format(wrapper.msg.__class__.__name__,
-                                                 wrapper.src, wrapper.dst))
+        if logger.tracing:
+            logger.trace('>> receive {} from {} to {}', wrapper.msg.__class__.__name__,
+                         wrapper.src, wrapper.dst)
         return wrapper
 
-    def _receive_len(self, conn, length):
-
-        read = 0
-        content = bytes()
-
-        while read < length:
-            data = self._receive(conn, length - read)
-            if not data:
-                break
-            read += len(data)
-            content += data
-
-        return content
-
     def to_message(self, version, msg_id, content):
 
-        if not version == VERSION:
+        if version not in VERSIONS:
             raise ProtocolVersionError('Version {} not supported'
                                        .format(version))
 
         if msg_id in self.messages:
             cls = self.messages[msg_id]
             msg = cls.__new__(cls)
-            msg.deserialize(content)
+            msg.deserialize(content, version)
             return msg
 
         raise ProtocolError("Unknown message type: {}".format(msg_id))
 
-    def _do_work(self, conn, address):
-        try:
-            self.on_connect(self, conn)
-            while self.working:
-                try:
-                    message = self.receive(conn)
-                    self.on_message(self, conn, message)
-                except socket.error, e:
-                    raise ProtocolError('Socket error: {}'.format(e))
-        except ProtocolError as e:
-            log('Protocol error [{}]: {}'.format(address, e))
-        except Exception as e:
-            log('Exception occurred [{}]: {}'.format(address, e))
-            traceback.print_exc()
-        finally:
-            log('Closing {}'.format(address))
-            self.on_disconnect(address)
-            conn.close()
-
-    @staticmethod
-    def _handle_socket_error(e):
-        err = e.args[0]
-        if err in [errno.EAGAIN, errno.EWOULDBLOCK, errno.EINPROGRESS]:
-            time.sleep(0.01)
-        else:
-            raise e
-
     def _connect(self, sock, addr):
 
         try:
             sock.connect(addr)
         except socket.error, e:
-            self._handle_socket_error(e)
+            if e.args[0] not in WOULD_BLOCK:
+                raise
 
         available = False
         while not available:
             _, w, _ = select.select([], [sock], [])
             available = bool(w)
 
-    def _sendall(self, conn, data):
-
-        length = len(data)
-        sent = 0
-
-        while self.working:
-
-            try:
-                sent += conn.send(data[sent:])
-            except socket.error, e:
-                self._handle_socket_error(e)
-            else:
-                if sent >= length:
-                    return sent
-
-    def _receive(self, conn, amount):
-
-        while self.working:
-
-            try:
-                data = conn.recv(amount)
-            except socket.error, e:
-                self._handle_socket_error(e)
-            else:
-                return data
-
 
 class ServerProtocol(Protocol):
 
@@ -257,12 +319,12 @@ class ServerProtocol(Protocol):
 
         if self.proxy:
             self._connect(sock, self.proxy)
-            self._do_work(sock, self.address)
+            self.transport.run(sock, self.address)
         else:
             sock.bind(self.address)
-            sock.listen(1)
+            sock.listen(socket.SOMAXCONN)
             log('Listening on {}'.format(self.address))
-            self._work(sock)
+            self.transport.serve(sock)
 
     def on_message(self, protocol, sock, msg_wrapper):
         if not super(ServerProtocol, self).on_message(protocol, sock, msg_wrapper):
@@ -292,30 +354,6 @@ class ServerProtocol(Protocol):
     def _on_result_message(self, protocol, sock, msg_wrapper):
         pass
 
-    def _accept(self, sock):
-
-        while self.working:
-
-            try:
-                connection, client_address = sock.accept()
-            except socket.error, e:
-                self._handle_socket_error(e)
-            else:
-                return connection, client_address
-
-    def _work(self, sock):
-
-        while self.working:
-
-            connection, client_address = self._accept(sock)
-
-            thread = Thread(target=self._in_thread, args=(connection, client_address))
-            thread.daemon = True
-            thread.start()
-
-    def _in_thread(self, connection, address):
-        self._do_work(connection, address)
-
 
 class ClientProtocol(Protocol):
 
@@ -331,7 +369,7 @@ class ClientProtocol(Protocol):
         else:
             self._connect(sock, self.address)
 
-        self._do_work(sock, self.address)
+        self.transport.run(sock, self.address)
 
     def on_message(self, protocol, sock, msg_wrapper):
         if not super(ClientProtocol, self).on_message(protocol, sock, msg_wrapper):
@@ -342,6 +380,8 @@ class ClientProtocol(Protocol):
                 self._on_resources_message(protocol, sock, msg_wrapper)
             elif isinstance(msg, Address):
                 self._on_address_message(protocol, sock, msg_wrapper)
+            elif isinstance(msg, ResultAck):
+                self._on_result_ack_message(protocol, sock, msg_wrapper)
             else:
                 raise ProtocolError('Unknown message type: {}'.format(msg))
 
@@ -354,3 +394,6 @@ class ClientProtocol(Protocol):
     @abstractmethod
     def _on_address_message(self, protocol, sock, msg_wrapper):
         pass
+
+    def _on_result_ack_message(self, protocol, sock, msg_wrapper):
+        pass
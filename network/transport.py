@@ -0,0 +1,478 @@
+import errno
+import select
+import socket
+import threading
+import time
+import traceback
+from abc import ABCMeta, abstractmethod
+from collections import deque
+from threading import Thread
+
+from errors import ProtocolError
+from framing import FrameDecoder
+from common.util import log
+
+WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINPROGRESS)
+
+
+class Transport(object):
+
+    __metaclass__ = ABCMeta
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self._local = threading.local()
+
+    @property
+    def working(self):
+        return self.protocol.working
+
+    @abstractmethod
+    def serve(self, sock):
+        pass
+
+    @abstractmethod
+    def run(self, conn, address):
+        pass
+
+    @abstractmethod
+    def sendall(self, conn, data):
+        pass
+
+    def stop(self):
+        pass
+
+    def forward(self, conn, data):
+        batches = self._batches()
+        if conn not in batches:
+            batches[conn] = []
+        batches[conn].append(data)
+
+    def flush_forwarded(self):
+        batches = self._batches()
+
+        try:
+            for conn, chunks in batches.iteritems():
+                if len(chunks) == 1:
+                    self._forward(conn, chunks[0], borrowed=True)
+                else:
+                    data = bytearray()
+                    for chunk in chunks:
+                        data += chunk
+                    self._forward(conn, data, borrowed=False)
+        finally:
+            batches.clear()
+
+    def _forward(self, conn, data, borrowed):
+        self.sendall(conn, data)
+
+    def _batches(self):
+        try:
+            return self._local.batches
+        except AttributeError:
+            self._local.batches = dict()
+            return self._local.batches
+
+
+class ThreadedTransport(Transport):
+
+    def __init__(self, protocol):
+        super(ThreadedTransport, self).__init__(protocol)
+        self._send_locks = dict()
+        self._lock = threading.Lock()
+
+    def serve(self, sock):
+
+        while self.working:
+
+            accepted = self._accept(sock)
+            if not accepted:
+                continue
+
+            thread = Thread(target=self.run, args=accepted)
+            thread.daemon = True
+            thread.start()
+
+    def run(self, conn, address):
+        protocol = self.protocol
+        decoder = FrameDecoder()
+
+        try:
+            protocol.on_connect(protocol, conn)
+            while self.working:
+                try:
+                    if self.recv_into(conn, decoder) == 0:
+                        raise ProtocolError('Connection terminated by other side')
+                    for frame in decoder:
+                        protocol.on_frame(conn, frame)
+                    self.flush_forwarded()
+                except socket.error, e:
+                    raise ProtocolError('Socket error: {}'.format(e))
+        except ProtocolError as e:
+            log('Protocol error [{}]: {}'.format(address, e))
+        except Exception as e:
+            log('Exception occurred [{}]: {}'.format(address, e))
+            traceback.print_exc()
+        finally:
+            log('Closing {}'.format(address))
+            protocol.on_disconnect(address, conn)
+            with self._lock:
+                self._send_locks.pop(conn, None)
+            conn.close()
+
+    def sendall(self, conn, data):
+
+        view = memoryview(data)
+        length = len(view)
+        sent = 0
+
+        with self._send_lock(conn):
+            while self.working:
+
+                try:
+                    sent += conn.send(view[sent:])
+                except socket.error, e:
+                    self._handle_socket_error(e)
+                else:
+                    if sent >= length:
+                        return sent
+
+    def _send_lock(self, conn):
+        with self._lock:
+            lock = self._send_locks.get(conn)
+            if not lock:
+                lock = self._send_locks[conn] = threading.Lock()
+            return lock
+
+    def recv_into(self, conn, decoder):
+
+        while self.working:
+
+            try:
+                return decoder.recv_from(conn)
+            except socket.error, e:
+                self._handle_socket_error(e)
+
+    def _accept(self, sock):
+
+        while self.working:
+
+            try:
+                connection, client_address = sock.accept()
+            except socket.error, e:
+                self._handle_socket_error(e)
+            else:
+                return connection, client_address
+
+    @staticmethod
+    def _handle_socket_error(e):
+        if e.args[0] in WOULD_BLOCK:
+            time.sleep(0.01)
+        else:
+            raise e
+
+
+class Poller(object):
+
+    READ = 0x001
+    WRITE = 0x004
+    ERROR = 0x008 | 0x010
+
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self._impl = select.epoll()
+            self._scale = 1.
+        elif hasattr(select, 'poll'):
+            self._impl = select.poll()
+            self._scale = 1000.
+        else:
+            self._impl = None
+            self._fds = dict()
+
+    def register(self, fd, events):
+        if self._impl:
+            self._impl.register(fd, events)
+        else:
+            self._fds[fd] = events
+
+    def modify(self, fd, events):
+        if self._impl:
+            self._impl.modify(fd, events)
+        else:
+            self._fds[fd] = events
+
+    def unregister(self, fd):
+        if self._impl:
+            self._impl.unregister(fd)
+        else:
+            self._fds.pop(fd, None)
+
+    def poll(self, timeout):
+        if self._impl:
+            return self._impl.poll(timeout * self._scale)
+
+        readers = [fd for fd, ev in self._fds.iteritems() if ev & self.READ]
+        writers = [fd for fd, ev in self._fds.iteritems() if ev & self.WRITE]
+        r, w, x = select.select(readers, writers, readers, timeout)
+
+        events = dict()
+        for fds, event in ((r, self.READ), (w, self.WRITE), (x, self.ERROR)):
+            for fd in fds:
+                events[fd] = events.get(fd, 0) | event
+        return events.items()
+
+
+class Connection(object):
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.address = address
+        self.events = Poller.READ
+
+        self.decoder = FrameDecoder()
+        self.outbound = deque()
+        self.lock = threading.RLock()
+
+
+class EventLoopTransport(Transport):
+
+    # Message handlers are executed on the loop thread. Data sent from
+    # other threads is queued and flushed by the loop.
+
+    POLL_TIMEOUT = 0.5
+
+    def __init__(self, protocol):
+        super(EventLoopTransport, self).__init__(protocol)
+
+        self._poller = None
+        self._thread = None
+        self._connections = dict()
+        self._pending = set()
+        self._lock = threading.Lock()
+
+        if hasattr(socket, 'socketpair'):
+            self._waker, self._wakee = socket.socketpair()
+            self._waker.setblocking(0)
+            self._wakee.setblocking(0)
+        else:
+            self._waker = self._wakee = None
+
+    def serve(self, sock):
+        self._loop(listener=sock)
+
+    def run(self, conn, address):
+        self._loop(initial=(conn, address))
+
+    def stop(self):
+        self._wake()
+
+    def sendall(self, conn, data):
+        self._write(self._connection(conn), data)
+        return len(data)
+
+    def _forward(self, conn, data, borrowed):
+        self._write(self._connection(conn), data, borrowed)
+
+    def _connection(self, conn):
+        try:
+            connection = self._connections.get(conn.fileno())
+        except socket.error:
+            connection = None
+        if not connection:
+            raise ProtocolError('Connection closed')
+        return connection
+
+    def _write(self, connection, data, borrowed=False):
+
+        with connection.lock:
+            connection.outbound.append(data)
+            pending = self._flush(connection)
+
+            # borrowed data references a receive buffer that is about to be reused
+            if pending and borrowed:
+                connection.outbound[-1] = memoryview(connection.outbound[-1]).tobytes()
+
+        if pending:
+            if threading.current_thread() is self._thread:
+                self._update_events(connection)
+            else:
+                with self._lock:
+                    self._pending.add(connection.fd)
+                self._wake()
+
+    def _loop(self, listener=None, initial=None):
+
+        self._thread = threading.current_thread()
+        self._poller = Poller()
+
+        if self._wakee:
+            self._poller.register(self._wakee.fileno(), Poller.READ)
+        if listener:
+            self._poller.register(listener.fileno(), Poller.READ)
+            log('Event loop serving {}'.format(self.protocol.address))
+        if initial:
+            self._open(*initial)
+
+        try:
+            while self.working and (listener or self._connections):
+                self._process_pending()
+
+                for fd, events in self._poller.poll(self.POLL_TIMEOUT):
+                    if self._wakee and fd == self._wakee.fileno():
+                        self._drain_waker()
+                    elif listener and fd == listener.fileno():
+                        self._accept(listener)
+                    elif fd in self._connections:
+                        self._handle(self._connections[fd], events)
+        finally:
+            for connection in self._connections.values():
+                self._close(connection, flush=True)
+            self._thread = None
+
+    def _accept(self, listener):
+
+        while self.working:
+
+            try:
+                conn, address = listener.accept()
+            except socket.error, e:
+                if e.args[0] in WOULD_BLOCK:
+                    return
+                raise
+
+            conn.setblocking(0)
+            self._open(conn, address)
+
+    def _open(self, conn, address):
+        connection = Connection(conn, address)
+        self._connections[connection.fd] = connection
+        self._poller.register(connection.fd, connection.events)
+
+        self._guarded(connection, self.protocol.on_connect,
+                      self.protocol, conn)
+
+    def _close(self, connection, flush=False):
+        if self._connections.pop(connection.fd, None) is None:
+            return
+
+        self._poller.unregister(connection.fd)
+
+        if flush and connection.outbound:
+            try:
+                connection.sock.setblocking(1)
+                connection.sock.settimeout(self.POLL_TIMEOUT)
+                with connection.lock:
+                    for chunk in connection.outbound:
+                        connection.sock.sendall(chunk)
+            except socket.error:
+                pass
+
+        log('Closing {}'.format(connection.address))
+        self.protocol.on_disconnect(connection.address, connection.sock)
+        connection.sock.close()
+
+    def _handle(self, connection, events):
+        if events & Poller.WRITE:
+            self._guarded(connection, self._on_writable, connection)
+        if events & (Poller.READ | Poller.ERROR):
+            self._guarded(connection, self._on_readable, connection)
+
+    def _guarded(self, connection, fn, *args):
+        address = connection.address
+
+        try:
+            fn(*args)
+        except socket.error, e:
+            log('Protocol error [{}]: Socket error: {}'.format(address, e))
+        except ProtocolError as e:
+            log('Protocol error [{}]: {}'.format(address, e))
+        except Exception as e:
+            log('Exception occurred [{}]: {}'.format(address, e))
+            traceback.print_exc()
+        else:
+            return
+        self._close(connection)
+
+    def _on_writable(self, connection):
+        self._flush(connection)
+        self._update_events(connection)
+
+    def _on_readable(self, connection):
+
+        try:
+            received = connection.decoder.recv_from(connection.sock)
+        except socket.error, e:
+            if e.args[0] in WOULD_BLOCK:
+                return
+            raise
+
+        if not received:
+            raise ProtocolError('Connection terminated by other side')
+
+        try:
+            for frame in connection.decoder:
+                self.protocol.on_frame(connection.sock, frame)
+                if connection.fd not in self._connections:
+                    break
+        finally:
+            self.flush_forwarded()
+
+    @staticmethod
+    def _flush(connection):
+        outbound = connection.outbound
+
+        with connection.lock:
+            while outbound:
+                chunk = outbound[0]
+                try:
+                    sent = connection.sock.send(chunk)
+                except socket.error, e:
+                    if e.args[0] in WOULD_BLOCK:
+                        break
+                    raise
+
+                if sent < len(chunk):
+                    outbound[0] = memoryview(chunk)[sent:]
+                    break
+                outbound.popleft()
+
+            return bool(outbound)
+
+    def _update_events(self, connection):
+        events = Poller.READ
+        if connection.outbound:
+            events |= Poller.WRITE
+
+        if events != connection.events and connection.fd in self._connections:
+            connection.events = events
+            self._poller.modify(connection.fd, events)
+
+    def _process_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+
+        for fd in pending:
+            connection = self._connections.get(fd)
+            if connection:
+                self._update_events(connection)
+
+    def _wake(self):
+        if self._waker:
+            try:
+                self._waker.send('\0')
+            except socket.error:
+                pass
+
+    def _drain_waker(self):
+        try:
+            while self._wakee.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+
+TRANSPORTS = {
+    'threaded': ThreadedTransport,
+    'event': EventLoopTransport,
+}
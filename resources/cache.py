@@ -0,0 +1,161 @@
+import errno
+import fcntl
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from common.util import generate_file, log
+
+LINK_AUTO = 'auto'
+LINK_HARDLINK = 'hardlink'
+LINK_REFLINK = 'reflink'
+LINK_COPY = 'copy'
+LINKS = [LINK_AUTO, LINK_HARDLINK, LINK_REFLINK, LINK_COPY]
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def hardlink(src, dst):
+    os.link(src, dst)
+
+
+def reflink(src, dst):
+    with open(src, 'rb') as src_file:
+        with open(dst, 'wb') as dst_file:
+            try:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            except IOError as exc:
+                raise OSError(exc.errno, 'Reflinks are not supported: {}'.format(exc))
+
+
+def copy(src, dst):
+    shutil.copyfile(src, dst)
+
+
+LINK_FUNCTIONS = {
+    LINK_HARDLINK: [hardlink],
+    LINK_REFLINK: [reflink],
+    LINK_COPY: [copy],
+    LINK_AUTO: [hardlink, reflink, copy],
+}
+
+
+class ResourceCache(object):
+
+    # Generated files keyed by (size, seed, source), stored as
+    # <directory>/<size>_<seed>_<source>/<multihash>. Files are handed out
+    # as links, so removing a round directory leaves the cache intact.
+
+    def __init__(self, directory, budget=None, link=LINK_AUTO):
+        self.directory = directory
+        self.budget = budget
+        self.link_functions = list(LINK_FUNCTIONS[link])
+
+        self.entries = OrderedDict()
+        self.used = 0
+        self._lock = threading.Lock()
+
+        self._load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get(self, size, seed, output_dir, source=None):
+        key = (size, seed, source)
+
+        with self._lock:
+            entry = self.entries.pop(key, None)
+            if entry:
+                self.entries[key] = entry
+            else:
+                entry = self._generate(key)
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        file_path = os.path.join(output_dir, os.path.basename(entry[0]))
+        self._link(entry[0], file_path)
+        return file_path
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.used = 0
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _generate(self, key):
+        size, seed, source = key
+        self._evict(size)
+
+        entry_dir = os.path.join(self.directory, self._entry_name(key))
+        file_path, _ = generate_file(size, entry_dir, source=source, seed=seed)
+
+        self.entries[key] = (file_path, size)
+        self.used += size
+        return self.entries[key]
+
+    def _evict(self, size):
+        while self.budget and self.entries and self.used + size > self.budget:
+            key, (file_path, entry_size) = self.entries.popitem(last=False)
+            shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+            self.used -= entry_size
+
+    def _link(self, src, dst):
+        for fn in list(self.link_functions):
+            try:
+                return fn(src, dst)
+            except OSError as exc:
+                if exc.errno == errno.EEXIST:
+                    return
+                if len(self.link_functions) == 1:
+                    raise
+                # do not retry a link type that is unsupported on this file system
+                log('Resource cache: {} failed ({}), falling back'.format(fn.__name__, exc))
+                self.link_functions.remove(fn)
+
+    def _load(self):
+        if not os.path.isdir(self.directory):
+            return
+
+        for name in sorted(os.listdir(self.directory)):
+            key = self._parse_entry_name(name)
+            entry_dir = os.path.join(self.directory, name)
+            files = [f for f in os.listdir(entry_dir) if not f.startswith('.')] \
+                if key and os.path.isdir(entry_dir) else None
+
+            if files:
+                file_path = os.path.join(entry_dir, files[0])
+                self.entries[key] = (file_path, key[0])
+                self.used += key[0]
+
+        if self.entries:
+            log('Resource cache: {} entries ({:.2f} MB) in {}'
+                .format(len(self.entries), self.used / 1048576., self.directory))
+
+    @staticmethod
+    def _entry_name(key):
+        return '{}_{}_{}'.format(*key)
+
+    @staticmethod
+    def _parse_entry_name(name):
+        parts = name.split('_', 2)
+        try:
+            size, seed = int(parts[0]), int(parts[1])
+        except (ValueError, IndexError):
+            return None
+        source = parts[2] if len(parts) == 3 and parts[2] != 'None' else None
+        return size, seed, source
@@ -5,6 +5,8 @@ class ResourceCommands(object):
 
     __metaclass__ = ABCMeta
 
+    name = None
+
     @classmethod
     @abstractmethod
     def peers(cls):
@@ -35,6 +37,21 @@ class ResourceCommands(object):
     def publish(cls, file_path):
         pass
 
+    @classmethod
+    def publish_async(cls, file_paths, callback):
+        # callback(hashes, error); backends that can detect readiness
+        # without blocking override this
+        try:
+            hashes = [cls.publish(file_path) for file_path in file_paths]
+        except Exception as exc:
+            callback(None, exc)
+        else:
+            callback(hashes, None)
+
+    @classmethod
+    def release(cls, file_path):
+        pass
+
     @classmethod
     @abstractmethod
     def connect(cls, peer):
@@ -54,3 +71,7 @@ class ResourceCommands(object):
     @abstractmethod
     def process(cls):
         pass
+
+    @classmethod
+    def running(cls):
+        return bool(cls.process())
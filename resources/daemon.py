@@ -0,0 +1,110 @@
+import socket
+import subprocess
+import time
+
+import psutil
+
+
+class DaemonError(Exception):
+    pass
+
+
+class DaemonManager(object):
+
+    def __init__(self, cmd, ready_line=None, ready_address=None,
+                 timeout=60, initial_delay=0.01, max_delay=0.5):
+
+        self.cmd = cmd
+        self.ready_line = ready_line
+        self.ready_address = ready_address
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+
+        self.popen = None
+        self.log_file_path = None
+        self._log_offset = 0
+
+    @property
+    def pid(self):
+        return self.popen.pid if self.running() else None
+
+    def running(self):
+        return self.popen is not None and self.popen.poll() is None
+
+    def process(self):
+        if self.running():
+            try:
+                return psutil.Process(self.popen.pid)
+            except psutil.NoSuchProcess:
+                pass
+
+    def start(self, log_file_path):
+        if self.running():
+            raise DaemonError('{} is already running'.format(self.cmd[0]))
+
+        self.log_file_path = log_file_path
+        self._log_offset = 0
+
+        with open(log_file_path, 'wb') as log_file:
+            self.popen = subprocess.Popen(self.cmd, stdout=log_file,
+                                          stderr=subprocess.STDOUT)
+        return self.wait_ready()
+
+    def wait_ready(self):
+        started = time.time()
+        delay = self.initial_delay
+
+        while True:
+            if self.popen.poll() is not None:
+                raise DaemonError('{} exited with code {}'
+                                  .format(self.cmd[0], self.popen.returncode))
+            if self._log_ready() or self.probe():
+                return time.time() - started
+            if time.time() - started > self.timeout:
+                raise DaemonError('{} not ready after {} s'
+                                  .format(self.cmd[0], self.timeout))
+
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_delay)
+
+    def probe(self):
+        if not self.ready_address:
+            return False
+
+        try:
+            sock = socket.create_connection(self.ready_address, timeout=self.max_delay)
+        except socket.error:
+            return False
+
+        sock.close()
+        return True
+
+    def stop(self, timeout=5):
+        if not self.running():
+            return
+
+        self.popen.terminate()
+        deadline = time.time() + timeout
+
+        while self.popen.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+
+        if self.popen.poll() is None:
+            self.popen.kill()
+            self.popen.wait()
+
+    def _log_ready(self):
+        if not (self.ready_line and self.log_file_path):
+            return False
+
+        with open(self.log_file_path, 'rb') as f:
+            f.seek(self._log_offset)
+            data = f.read()
+
+        if self.ready_line in data:
+            return True
+
+        # keep the tail in case the line is still being written
+        self._log_offset += max(0, len(data) - len(self.ready_line))
+        return False
@@ -1,15 +1,24 @@
 import os
 import subprocess
-
-import re
+import threading
 
 from resources.commands import ResourceCommands
+from resources.dat.sharing import SharingService
 
 
 class DatCommands(ResourceCommands):
 
+    name = 'dat'
+
     executable = ['dat']
-    processes = dict()
+    service = SharingService(executable)
+
+    @classmethod
+    def configure(cls, max_processes=None, ttl=None):
+        if max_processes is not None:
+            cls.service.max_processes = max_processes
+        if ttl is not None:
+            cls.service.ttl = ttl
 
     @classmethod
     def get(cls, hash_entry, output_dir):
@@ -21,27 +30,42 @@ class DatCommands(ResourceCommands):
 
     @classmethod
     def pre_publish(cls):
-        for p in cls.processes.values():
-            p.kill()
+        cls.service.expire()
+
+    @classmethod
+    def release(cls, file_path):
+        cls.service.release(os.path.dirname(file_path))
 
     @classmethod
     def publish(cls, file_path):
+        link = cls.service.publish(os.path.dirname(file_path))
+        print "Sharing", os.path.dirname(file_path), link
+        return link
 
-        process = subprocess.Popen(
-            cls.executable + [os.path.dirname(file_path)],
-            bufsize=1,
-            stdout=subprocess.PIPE
-        )
-        cls.processes[file_path] = process
-
-        address_re = re.compile("Share Link: ([a-z0-9]+)")
-        while True:
-            line = process.stdout.readline().strip()
-            if line:
-                m = address_re.match(line)
-                if m:
-                    print "Sharing", os.path.dirname(file_path), m.group(1)
-                    return m.group(1)
+    @classmethod
+    def publish_async(cls, file_paths, callback):
+        if not file_paths:
+            callback([], None)
+            return
+
+        sharers = [cls.service.share(os.path.dirname(f)) for f in file_paths]
+        remaining = [len(sharers)]
+        lock = threading.Lock()
+
+        def on_ready(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            try:
+                links = [s.wait(0) for s in sharers]
+            except Exception as exc:
+                callback(None, exc)
+            else:
+                callback(links, None)
+
+        for sharer in sharers:
+            sharer.add_callback(on_ready)
 
     @classmethod
     def connect(cls, peer):
@@ -53,7 +77,7 @@ class DatCommands(ResourceCommands):
 
     @classmethod
     def stop_daemon(cls):
-        pass
+        cls.service.stop()
 
     @classmethod
     def address(cls):
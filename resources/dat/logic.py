@@ -6,6 +6,10 @@ class DatClientSession(ResourceClientSession):
     commands = DatCommands
     is_daemon = False
 
+    def tear_down(self):
+        super(DatClientSession, self).tear_down()
+        self.commands.stop_daemon()
+
     @classmethod
     def _create_address(cls, ip_address, msg_address):
         return msg_address
@@ -15,6 +19,10 @@ class DatServerSession(ResourceServerSession):
     commands = DatCommands
     is_daemon = False
 
+    def tear_down(self):
+        super(DatServerSession, self).tear_down()
+        self.commands.stop_daemon()
+
     @classmethod
     def _create_address(cls, ip_address, msg_address):
         return msg_address
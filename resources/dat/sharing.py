@@ -0,0 +1,172 @@
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from common.util import log
+
+LINK_RE = re.compile("Share Link: ([a-z0-9]+)")
+
+
+class SharingError(Exception):
+    pass
+
+
+class Sharer(object):
+
+    # A long-lived `dat <directory>` process. Its output is read by a
+    # separate thread, which publishes the share link once it appears.
+
+    def __init__(self, executable, directory):
+        self.directory = directory
+        self.link = None
+        self.error = None
+        self.started = self.last_used = time.time()
+
+        self._ready = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+        self.process = subprocess.Popen(executable + [directory], bufsize=1,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT)
+
+        self._thread = threading.Thread(target=self._read)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def alive(self):
+        return self.process.poll() is None and not self.error
+
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        if not self._ready.wait(timeout):
+            raise SharingError('No share link for {} after {} s'.format(self.directory, timeout))
+        if self.error:
+            raise self.error
+        return self.link
+
+    def add_callback(self, callback):
+        with self._lock:
+            if not self._ready.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def _read(self):
+        # keep draining the output, so that the process never blocks on a full pipe
+        for line in iter(self.process.stdout.readline, ''):
+            if not self._ready.is_set():
+                m = LINK_RE.search(line)
+                if m:
+                    self._set_ready(link=m.group(1))
+
+        if not self._ready.is_set():
+            self._set_ready(error=SharingError('Dat exited with code {} while sharing {}'
+                                               .format(self.process.wait(), self.directory)))
+
+    def _set_ready(self, link=None, error=None):
+        with self._lock:
+            self.link = link
+            self.error = error
+            self._ready.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            callback(self)
+
+
+class SharingService(object):
+
+    # One sharer per published directory. Sharers outlive the round they
+    # were published in, as peers may still be downloading from them, and
+    # are evicted least recently used first when more than `max_processes`
+    # are running, and when unused for `ttl` seconds.
+
+    def __init__(self, executable, max_processes=16, ttl=300, ready_timeout=60):
+        self.executable = executable
+        self.max_processes = max_processes
+        self.ttl = ttl
+        self.ready_timeout = ready_timeout
+
+        self.sharers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sharers)
+
+    def share(self, directory):
+        directory = os.path.abspath(directory)
+
+        with self._lock:
+            sharer = self.sharers.pop(directory, None)
+            evicted = []
+
+            if sharer and not sharer.alive():
+                evicted.append(sharer)
+                sharer = None
+
+            if not sharer:
+                sharer = Sharer(self.executable, directory)
+
+            sharer.last_used = time.time()
+            self.sharers[directory] = sharer
+
+            # sharers still waiting for their link are being published right now
+            # and are kept, even if that exceeds the cap for a while
+            excess = len(self.sharers) - self.max_processes if self.max_processes else 0
+            for key, candidate in self.sharers.items():
+                if excess <= 0:
+                    break
+                if candidate is not sharer and candidate.ready():
+                    evicted.append(self.sharers.pop(key))
+                    excess -= 1
+
+        self._kill(evicted)
+        return sharer
+
+    def publish(self, directory, timeout=None):
+        sharer = self.share(directory)
+        return sharer.wait(timeout or self.ready_timeout)
+
+    def publish_async(self, directory, callback):
+        sharer = self.share(directory)
+        sharer.add_callback(callback)
+        return sharer
+
+    def release(self, directory):
+        with self._lock:
+            sharer = self.sharers.pop(os.path.abspath(directory), None)
+        self._kill([sharer] if sharer else [])
+
+    def expire(self):
+        now = time.time()
+
+        with self._lock:
+            expired = [d for d, s in self.sharers.iteritems()
+                       if not s.alive() or not os.path.exists(d)
+                       or (self.ttl and now - s.last_used > self.ttl)]
+            evicted = [self.sharers.pop(d) for d in expired]
+
+        self._kill(evicted)
+
+    def stop(self):
+        with self._lock:
+            evicted = self.sharers.values()
+            self.sharers.clear()
+        self._kill(evicted)
+
+    @staticmethod
+    def _kill(sharers):
+        for sharer in sharers:
+            log('Stopping Dat sharer for {}'.format(sharer.directory))
+            sharer.kill()
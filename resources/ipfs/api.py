@@ -0,0 +1,131 @@
+import httplib
+import json
+import os
+import socket
+import tarfile
+import threading
+import urllib
+import uuid
+
+CHUNK_SIZE = 256 * 1024
+
+
+class IPFSApiError(Exception):
+    pass
+
+
+class IPFSApi(object):
+
+    def __init__(self, host='127.0.0.1', port=5001, base_path='/api/v0', timeout=None):
+        self.host = host
+        self.port = port
+        self.base_path = base_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def id(self):
+        return self._json('id')
+
+    def add(self, file_path):
+        file_name = os.path.basename(file_path)
+        boundary = uuid.uuid4().hex
+
+        head = ('--{}\r\n'
+                'Content-Disposition: form-data; name="file"; filename="{}"\r\n'
+                'Content-Type: application/octet-stream\r\n\r\n'
+                .format(boundary, urllib.quote(file_name)))
+        tail = '\r\n--{}--\r\n'.format(boundary)
+        length = len(head) + os.path.getsize(file_path) + len(tail)
+
+        def send(conn):
+            conn.send(head)
+            with open(file_path, 'rb') as f:
+                chunk = f.read(CHUNK_SIZE)
+                while chunk:
+                    conn.send(chunk)
+                    chunk = f.read(CHUNK_SIZE)
+            conn.send(tail)
+
+        headers = {
+            'Content-Type': 'multipart/form-data; boundary={}'.format(boundary),
+            'Content-Length': str(length),
+        }
+
+        response = self._request('add', body=send, headers=headers)
+        lines = response.read().strip().splitlines()
+        return json.loads(lines[-1])['Hash']
+
+    def get(self, path, output_dir):
+        output_dir = os.path.abspath(output_dir)
+        response = self._request('get', [path])
+
+        try:
+            archive = tarfile.open(fileobj=response, mode='r|')
+            for member in archive:
+                target = os.path.abspath(os.path.join(output_dir, member.name))
+                if not target.startswith(output_dir + os.sep):
+                    raise IPFSApiError('Invalid path in archive: {}'.format(member.name))
+                archive.extract(member, output_dir)
+        finally:
+            # drain the tar padding so that the connection can be reused
+            response.read()
+
+    def swarm_connect(self, address):
+        return self._json('swarm/connect', [address])
+
+    def swarm_peers(self):
+        return self._json('swarm/peers').get('Peers') or []
+
+    def log_level(self, subsystem, level):
+        return self._json('log/level', [subsystem, level])
+
+    def _json(self, command, args=()):
+        return json.loads(self._request(command, args).read())
+
+    def _request(self, command, args=(), body=None, headers=None):
+        path = '{}/{}'.format(self.base_path, command)
+        if args:
+            path += '?' + urllib.urlencode([('arg', a) for a in args])
+
+        try:
+            return self._send(path, body, headers)
+        except (socket.error, httplib.BadStatusLine, httplib.CannotSendRequest):
+            # the keep-alive connection may have been closed by the daemon
+            self._reset()
+            return self._send(path, body, headers)
+
+    def _send(self, path, body, headers):
+        conn = self._connection()
+
+        if callable(body):
+            conn.putrequest('POST', path)
+            for key, value in (headers or {}).iteritems():
+                conn.putheader(key, value)
+            conn.endheaders()
+            body(conn)
+        else:
+            conn.request('POST', path, body, headers or {})
+
+        response = conn.getresponse()
+        if response.status != httplib.OK:
+            message = response.read()
+            try:
+                message = json.loads(message).get('Message', message)
+            except ValueError:
+                pass
+            raise IPFSApiError('{} {}: {}'.format(response.status, path, message))
+
+        return response
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if not conn:
+            conn = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _reset(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn:
+            conn.close()
+        self._local.conn = None
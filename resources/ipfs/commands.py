@@ -1,14 +1,24 @@
+import httplib
 import os
+import socket
 import subprocess
 import time
 
-import psutil
-
+from common.util import log
+from network.protocol import address_from_string
 from resources.commands import ResourceCommands
+from resources.daemon import DaemonManager
+from resources.ipfs.api import IPFSApi
 
 
 class IPFSCommands(ResourceCommands):
 
+    name = 'ipfs'
+
+    daemon = DaemonManager(['ipfs', 'daemon'],
+                           ready_line='Daemon is ready',
+                           ready_address=('127.0.0.1', 5001))
+
     @classmethod
     def peers(cls):
         return subprocess.check_output(['ipfs', 'swarm', 'peers']).split('\n')
@@ -26,17 +36,12 @@ class IPFSCommands(ResourceCommands):
             log_file_name = 'daemon_{}.log'.format(time.time())
         log_file_path = os.path.join(log_dir, log_file_name)
 
-        cmd = ['ipfs', 'daemon']
-        assert subprocess.Popen(cmd,
-                                stdout=open(log_file_path, 'wb'),
-                                stderr=subprocess.STDOUT).pid
-        time.sleep(5)
+        elapsed = cls.daemon.start(log_file_path)
+        log('IPFS daemon ready after {:.2f} s'.format(elapsed))
 
     @classmethod
     def stop_daemon(cls):
-        p = cls.process()
-        if p and p.pid:
-            p.kill()
+        cls.daemon.stop()
 
     @classmethod
     def pre_publish(cls):
@@ -67,11 +72,74 @@ class IPFSCommands(ResourceCommands):
 
     @classmethod
     def process(cls):
-        process_names = ['ipfs.exe', 'ipfs']
-        for p in psutil.process_iter():
-            if p.name() in process_names:
-                return p
+        return cls.daemon.process()
+
+    @classmethod
+    def running(cls):
+        return cls.daemon.running() or cls.daemon.probe()
 
     @classmethod
     def hash_from_address(cls, source):
         return source.split('/')[-1]
+
+
+class IPFSAPICommands(IPFSCommands):
+
+    name = 'ipfs-api'
+
+    api = IPFSApi()
+
+    @classmethod
+    def configure(cls, address):
+        host, port = address_from_string(address)
+        cls.api = IPFSApi(host, port)
+        cls.daemon.ready_address = (host, port)
+
+    @classmethod
+    def peers(cls):
+        return cls._call(super(IPFSAPICommands, cls).peers, lambda: [
+            '{}/ipfs/{}'.format(p['Addr'], p['Peer'])
+            for p in cls.api.swarm_peers()
+        ])
+
+    @classmethod
+    def address(cls):
+        def address():
+            address = cls.api.id()['ID']
+            assert address
+            return address
+        return cls._call(super(IPFSAPICommands, cls).address, address)
+
+    @classmethod
+    def publish(cls, file_path):
+        return cls._call(super(IPFSAPICommands, cls).publish,
+                         lambda: cls.api.add(file_path), file_path)
+
+    @classmethod
+    def connect(cls, peer):
+        cls._call(super(IPFSAPICommands, cls).connect,
+                  lambda: cls.api.swarm_connect(peer), peer)
+
+    @classmethod
+    def get(cls, hash_entry, output_dir):
+        def get():
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+            cls.api.get('/ipfs/{}'.format(hash_entry), output_dir)
+        cls._call(super(IPFSAPICommands, cls).get, get, hash_entry, output_dir)
+
+    @classmethod
+    def log_level(cls, _all='debug', _dht='warning', **kwargs):
+        def log_level():
+            cls.api.log_level('all', _all)
+            cls.api.log_level('dht', _dht)
+        cls._call(super(IPFSAPICommands, cls).log_level, log_level,
+                  _all=_all, _dht=_dht, **kwargs)
+
+    @classmethod
+    def _call(cls, fallback, fn, *args, **kwargs):
+        try:
+            return fn()
+        except (socket.error, httplib.HTTPException) as exc:
+            log('IPFS API unavailable ({}), using the CLI'.format(exc))
+            return fallback(*args, **kwargs)
@@ -1,4 +1,4 @@
-from resources.ipfs.commands import IPFSCommands
+from resources.ipfs.commands import IPFSCommands, IPFSAPICommands
 from resources.logic import ResourceClientSession, ResourceServerSession
 
 
@@ -18,3 +18,11 @@ class IPFSClientSession(IPFSAddressCreatorMixin, ResourceClientSession):
 
 class IPFSServerSession(IPFSAddressCreatorMixin, ResourceServerSession):
     commands = IPFSCommands
+
+
+class IPFSAPIClientSession(IPFSAddressCreatorMixin, ResourceClientSession):
+    commands = IPFSAPICommands
+
+
+class IPFSAPIServerSession(IPFSAddressCreatorMixin, ResourceServerSession):
+    commands = IPFSAPICommands
@@ -0,0 +1,148 @@
+import httplib
+import os
+import tempfile
+import urllib
+
+import psutil
+
+from common.util import CHUNK_SIZE, log
+from network.protocol import address_from_string
+from resources.commands import ResourceCommands
+from resources.local.server import FILE_NAME_HEADER, LocalServer, Shaper
+from resources.local.store import LocalStore
+
+
+class LocalCommands(ResourceCommands):
+
+    # Hermetic backend: files are published to a local content-addressed
+    # store and served over HTTP by an in-process server. Hashes carry the
+    # server's address (<hash>@<host>:<port>), so no peer discovery is needed.
+
+    name = 'local'
+
+    host = '127.0.0.1'
+    port = 0
+    directory = None
+    shaper = Shaper()
+    timeout = 60
+
+    store = None
+    server = None
+    users = 0
+    peer_list = []
+
+    @classmethod
+    def configure(cls, address=None, directory=None, bandwidth=None, latency=0):
+        if address:
+            cls.host, cls.port = address_from_string(address)
+        cls.directory = directory
+        cls.shaper = Shaper(bandwidth, latency)
+
+    @classmethod
+    def peers(cls):
+        return list(cls.peer_list)
+
+    @classmethod
+    def address(cls):
+        return '{}:{}'.format(*cls.server.address)
+
+    @classmethod
+    def start_daemon(cls, log_dir, log_file_name=None):
+        # sessions running in the same process share a single server
+        cls.users += 1
+        if cls.running():
+            return
+
+        # a store per process: the configured directory may be shared by
+        # every node started with the same output directory
+        if cls.directory and not os.path.isdir(cls.directory):
+            try:
+                os.makedirs(cls.directory)
+            except OSError:
+                # created by another process meanwhile
+                if not os.path.isdir(cls.directory):
+                    raise
+        directory = tempfile.mkdtemp(prefix='local_store_', dir=cls.directory)
+
+        cls.store = LocalStore(directory)
+        cls.server = LocalServer((cls.host, cls.port), cls.store, cls.shaper)
+        cls.server.start()
+        log('Local resource server listening on {}'.format(cls.address()))
+
+    @classmethod
+    def stop_daemon(cls):
+        cls.users = max(0, cls.users - 1)
+        if cls.users:
+            return
+
+        if cls.server:
+            cls.server.stop()
+            cls.server = None
+        if cls.store:
+            cls.store.clear()
+            cls.store = None
+
+    @classmethod
+    def pre_publish(cls):
+        pass
+
+    @classmethod
+    def publish(cls, file_path):
+        file_hash = cls.store.add(file_path)
+        return '{}@{}'.format(file_hash, cls.address())
+
+    @classmethod
+    def release(cls, file_path):
+        if cls.store:
+            cls.store.remove(file_path)
+
+    @classmethod
+    def connect(cls, peer):
+        if peer not in cls.peer_list:
+            cls.peer_list.append(peer)
+
+    @classmethod
+    def get(cls, hash_entry, output_dir):
+        file_hash, address = hash_entry.rsplit('@', 1)
+        host, port = address_from_string(address)
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        conn = httplib.HTTPConnection(host, port, timeout=cls.timeout)
+        try:
+            conn.request('GET', '/' + urllib.quote(file_hash))
+            response = conn.getresponse()
+            if response.status != httplib.OK:
+                raise IOError('{} {}: {}'.format(response.status, hash_entry,
+                                                 response.read()))
+
+            file_name = os.path.basename(response.getheader(FILE_NAME_HEADER) or file_hash)
+            expected = int(response.getheader('Content-Length'))
+            received = 0
+
+            with open(os.path.join(output_dir, file_name), 'wb') as f:
+                chunk = response.read(CHUNK_SIZE)
+                while chunk:
+                    f.write(chunk)
+                    received += len(chunk)
+                    chunk = response.read(CHUNK_SIZE)
+        finally:
+            conn.close()
+
+        if received != expected:
+            raise IOError('Incomplete download of {}: {} of {} B'
+                          .format(hash_entry, received, expected))
+
+    @classmethod
+    def log_level(cls, **_):
+        pass
+
+    @classmethod
+    def process(cls):
+        if cls.running():
+            return psutil.Process(os.getpid())
+
+    @classmethod
+    def running(cls):
+        return bool(cls.server and cls.server.running())
@@ -0,0 +1,18 @@
+from resources.local.commands import LocalCommands
+from resources.logic import ResourceClientSession, ResourceServerSession
+
+
+class LocalClientSession(ResourceClientSession):
+    commands = LocalCommands
+
+    @classmethod
+    def _create_address(cls, ip_address, msg_address):
+        return msg_address
+
+
+class LocalServerSession(ResourceServerSession):
+    commands = LocalCommands
+
+    @classmethod
+    def _create_address(cls, ip_address, msg_address):
+        return msg_address
@@ -0,0 +1,104 @@
+import BaseHTTPServer
+import SocketServer
+import os
+import threading
+import time
+import urllib
+
+from common.util import CHUNK_SIZE
+
+FILE_NAME_HEADER = 'X-File-Name'
+
+
+class Shaper(object):
+
+    # Per-transfer pacing: `bandwidth` in bytes/s (None for unlimited),
+    # `latency` in seconds added before the first byte.
+
+    def __init__(self, bandwidth=None, latency=0):
+        self.bandwidth = bandwidth
+        self.latency = latency
+
+    def chunk_size(self):
+        if self.bandwidth:
+            # ~10 writes per second keeps the pace smooth
+            return max(1024, min(CHUNK_SIZE, int(self.bandwidth / 10)))
+        return CHUNK_SIZE
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def pace(self, started, sent):
+        if self.bandwidth:
+            ahead = sent / float(self.bandwidth) - (time.time() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+class LocalRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        file_hash = urllib.unquote(self.path.lstrip('/'))
+        file_path = self.server.store.find(file_hash)
+        shaper = self.server.shaper
+
+        shaper.delay()
+
+        if not file_path:
+            self.send_error(404, 'Unknown hash: {}'.format(file_hash))
+            return
+
+        with open(file_path, 'rb') as f:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.send_header(FILE_NAME_HEADER, os.path.basename(file_path))
+            self.end_headers()
+
+            chunk_size = shaper.chunk_size()
+            started = time.time()
+            sent = 0
+
+            chunk = f.read(chunk_size)
+            while chunk:
+                sent += len(chunk)
+                shaper.pace(started, sent)
+                self.wfile.write(chunk)
+                chunk = f.read(chunk_size)
+
+    def log_message(self, *_):
+        pass
+
+
+class LocalServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, store, shaper=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, LocalRequestHandler)
+        self.store = store
+        self.shaper = shaper or Shaper()
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, kwargs=dict(poll_interval=0.1))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def running(self):
+        return bool(self._thread and self._thread.is_alive())
@@ -0,0 +1,63 @@
+import os
+import shutil
+import threading
+
+from common.util import file_multihash
+
+HEX_DIGITS = '0123456789abcdef'
+
+
+class LocalStore(object):
+
+    # Content-addressed directory: <directory>/<hash>/<file name>
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.published = dict()
+        self._lock = threading.Lock()
+
+    def add(self, file_path):
+        file_hash = file_multihash(file_path)
+        entry_dir = os.path.join(self.directory, file_hash)
+        entry_path = os.path.join(entry_dir, os.path.basename(file_path))
+
+        with self._lock:
+            if not os.path.exists(entry_path):
+                if not os.path.exists(entry_dir):
+                    os.makedirs(entry_dir)
+                try:
+                    os.link(file_path, entry_path)
+                except OSError:
+                    shutil.copyfile(file_path, entry_path)
+            self.published[file_path] = file_hash
+
+        return file_hash
+
+    def remove(self, file_path):
+        with self._lock:
+            file_hash = self.published.pop(file_path, None)
+            if file_hash and file_hash not in self.published.itervalues():
+                shutil.rmtree(os.path.join(self.directory, file_hash), ignore_errors=True)
+
+    def find(self, file_hash):
+        if not file_hash or file_hash.strip(HEX_DIGITS):
+            return None
+
+        entry_dir = os.path.join(self.directory, file_hash)
+        if not os.path.isdir(entry_dir):
+            return None
+
+        for file_name in os.listdir(entry_dir):
+            return os.path.join(entry_dir, file_name)
+
+    def clear(self):
+        # only the entries published here; other processes may share the parent
+        with self._lock:
+            for file_hash in set(self.published.itervalues()):
+                shutil.rmtree(os.path.join(self.directory, file_hash), ignore_errors=True)
+            self.published.clear()
+
+            try:
+                os.rmdir(self.directory)
+            except OSError:
+                pass
@@ -1,13 +1,22 @@
 import os
+import random
+import threading
+import time
+import traceback
 import uuid
 from abc import ABCMeta, abstractmethod
+from collections import Counter, defaultdict
+from multiprocessing.pool import ThreadPool
 
 import shutil
 
 from common.util import generate_file, log
-from monitor.logic import Logic, timed_download
-from network.message import GetAddress, Result, GetResources, Address, Resources
+from monitor.logic import Logic, timed_download, timed_batch, CLIENT_FETCH, SERVER_FETCH
+from network.message import GetAddress, Result, ResultAck, GetResources, Address, Resources, \
+    VERSION
 from network.protocol import ClientProtocol, ServerProtocol
+from resources.pool import ResourcePool
+from resources.scenario import Scenario
 
 
 class ResourceCreator(object):
@@ -17,29 +26,56 @@ class ResourceCreator(object):
         self.default_file_size = default_file_size
 
     @abstractmethod
-    def create(self, identifier, directory, file_size=None):
+    def create(self, identifier, directory, file_size=None, index=0):
+        pass
+
+    @abstractmethod
+    def generate(self, directory, file_size=None, index=0):
         pass
 
 
 class OneShotResourceCreator(ResourceCreator):
 
-    def __init__(self, default_file_size):
+    def __init__(self, default_file_size, source=None, seed=None, cache=None, seed_offset=0):
         super(OneShotResourceCreator, self).__init__(default_file_size)
         self.resource_dirs = dict()
+        self.source = source
+        self.random = random.Random(seed) if seed is not None else None
+        self._lock = threading.Lock()
 
-    def create(self, identifier, directory, file_size=None):
+        # warm content: files are taken from the cache, seeded by their index
+        # in the round, so every round serves the same, distinct files
+        self.cache = cache
+        self.base_seed = (seed or 0) + seed_offset
+
+    def create(self, identifier, directory, file_size=None, index=0):
 
         if identifier in self.resource_dirs:
             last_dir = self.resource_dirs.pop(identifier)
             if os.path.exists(last_dir):
                 shutil.rmtree(last_dir)
 
+        file_path = self.generate(directory, file_size, index)
+        self.resource_dirs[identifier] = os.path.basename(os.path.dirname(file_path))
+
+        return file_path
+
+    def generate(self, directory, file_size=None, index=0):
+
         sub_dir = str(uuid.uuid4())
         file_size = file_size if file_size is not None else self.default_file_size
-        file_path, _ = generate_file(file_size * 1024 * 1024, os.path.join(directory, sub_dir))
 
-        self.resource_dirs[identifier] = sub_dir
+        size_bytes = int(file_size * 1024 * 1024)
+
+        if self.cache is not None:
+            return self.cache.get(size_bytes, self.base_seed + index,
+                                  os.path.join(directory, sub_dir), source=self.source)
 
+        with self._lock:
+            seed = self.random.getrandbits(64) if self.random else None
+
+        file_path, _ = generate_file(size_bytes, os.path.join(directory, sub_dir),
+                                     source=self.source, seed=seed)
         return file_path
 
 
@@ -50,16 +86,21 @@ class ResourceSession(Logic):
 
     is_daemon = True
 
-    def __init__(self, output_dir, log_dir, file_size, peers=None, connect=False):
+    def __init__(self, output_dir, log_dir, file_size, peers=None, connect=False,
+                 source=None, seed=None, cache=None, seed_offset=0,
+                 scenario=None):
 
         super(ResourceSession, self).__init__()
 
         self.peers = peers or []
         self.output_dir = output_dir
         self.log_dir = log_dir
-        self.manage_daemon = self.is_daemon and not self.commands.process()
-        self.resource_creator = OneShotResourceCreator(file_size)
+        self.manage_daemon = self.is_daemon and not self.commands.running()
+        self.resource_creator = OneShotResourceCreator(file_size, source=source, seed=seed,
+                                                       cache=cache, seed_offset=seed_offset)
         self.direct_connections = connect
+        self.file_size = file_size
+        self.scenario = scenario
 
     def set_up(self, state):
 
@@ -69,10 +110,11 @@ class ResourceSession(Logic):
             os.makedirs(self.log_dir)
 
         super(ResourceSession, self).set_up(state)
+        self.tracer = state.tracer
 
         if self.manage_daemon:
             self.commands.start_daemon(self.log_dir)
-            assert self.commands.process(), 'Could not start the daemon'
+            assert self.commands.running(), 'Could not start the daemon'
             self.commands.log_level()
 
         if self.direct_connections:
@@ -97,15 +139,39 @@ class ResourceClientSession(ResourceSession, ClientProtocol):
     __metaclass__ = ABCMeta
 
     def __init__(self, name, address, output_dir, log_dir, n_tasks,
-                 file_size=10, proxy=None, connect=False):
-
-        ClientProtocol.__init__(self, name, address, proxy=proxy)
-        ResourceSession.__init__(self, output_dir, log_dir, file_size, connect=connect)
-
-        self.n_tasks = n_tasks
+                 file_size=10, proxy=None, connect=False, source=None, seed=None,
+                 cache=None, transport=None, raw_relay=True, version=VERSION, concurrency=1,
+                 scenario=None, pipeline=1):
+
+        ClientProtocol.__init__(self, name, address, proxy=proxy,
+                                transport=transport, raw_relay=raw_relay,
+                                version=version)
+        # warm results must not repeat the server's resources
+        ResourceSession.__init__(self, output_dir, log_dir, file_size, connect=connect,
+                                 source=source, seed=seed, cache=cache,
+                                 seed_offset=1 << 16,
+                                 scenario=scenario or Scenario.default(n_tasks))
+
+        self.n_tasks = self.scenario.rounds or n_tasks
+        self.concurrency = concurrency
+        self.download_pools = dict()
         self.resource_dir = os.path.join(self.output_dir, 'resources_client')
+
+        # pipelined mode: up to `pipeline` rounds are in flight, identified by
+        # round ids carried in the messages, and processed by a worker pool
+        self.pipeline = max(1, pipeline)
+        self.round_pool = None
+        self.requested = 0
+        self.completed = 0
+        self._round_lock = threading.Lock()
+        self.request_times = dict()
         self.result_dir = os.path.join(self.output_dir, 'results_client')
 
+        # results not acknowledged by the server yet; their files are served
+        # until then, so the session only ends once all of them are fetched
+        self.pending_results = Counter()
+        self.finishing = False
+
     # ClientProtocol
 
     def on_connect(self, protocol, sock):
@@ -114,22 +180,127 @@ class ResourceClientSession(ResourceSession, ClientProtocol):
 
     def _on_resources_message(self, protocol, sock, msg_wrapper):
 
-        msg = msg_wrapper.msg
-        for _hash in msg.hashes:
-            with timed_download(self.state, protocol):
-                self.commands.get(_hash, os.path.join(self.resource_dir, "d_" + _hash))
-        self.commands.pre_publish()
+        if self.round_pool:
+            self.round_pool.apply_async(self._pipelined_round, (protocol, sock, msg_wrapper))
+            return
 
-        sub_dir = str(uuid.uuid4())
-        file_path = self.resource_creator.create(msg_wrapper.src, os.path.join(self.result_dir, sub_dir))
-        file_hash = self.commands.publish(file_path)
-        protocol.send(sock, Result(file_hash), dst=msg_wrapper.src)
+        phase = self._round(protocol, sock, msg_wrapper, self.state.rounds)
 
         if self.state.rounds < self.n_tasks - 1:
             self.state.new_round()
-            protocol.send(sock, GetResources(), dst=msg_wrapper.src)
+            self._schedule_request(protocol, sock, msg_wrapper.src,
+                                   self.scenario.sample(phase.think_time))
         else:
+            self._finish()
+
+    def _pipelined_round(self, protocol, sock, msg_wrapper):
+        try:
+            phase = self._round(protocol, sock, msg_wrapper, msg_wrapper.msg.round_id)
+        except Exception as exc:
+            log('Error in round {}: {}'.format(msg_wrapper.msg.round_id, exc))
+            self.state.backtrace = traceback.format_exc()
+            self.state.exception = exc
             self.stop()
+            return
+
+        with self._round_lock:
+            self.completed += 1
+            done = self.completed >= self.n_tasks
+            round_id = self.requested if self.requested < self.n_tasks else None
+            if round_id is not None:
+                self.requested += 1
+
+        # as in stop-and-wait mode, the last round does not start a new one
+        if not done:
+            self.state.new_round()
+
+        if done:
+            self._finish()
+        elif round_id is not None:
+            self._schedule_request(protocol, sock, msg_wrapper.src,
+                                   self.scenario.sample(phase.think_time), round_id)
+
+    def _round(self, protocol, sock, msg_wrapper, round_number):
+
+        msg = msg_wrapper.msg
+        phase = self.scenario.phase(round_number)
+        tracer = self.tracer
+
+        requested = self.request_times.pop(round_number, None)
+        if requested:
+            tracer.record('request', requested, time.time(), self.name, round_number)
+
+        with tracer.span('round', self.name, round_number):
+
+            with tracer.span('download'), timed_batch(self.state, msg_wrapper.src):
+                self._download(msg_wrapper.src, msg.hashes,
+                               phase.concurrency or self.concurrency, round_number)
+            with tracer.span('pre_publish'):
+                self.commands.pre_publish()
+
+            for i in xrange(phase.results):
+                sub_dir = str(uuid.uuid4())
+                file_size = self.scenario.sample(phase.result_size, self.file_size)
+                with tracer.span('create'):
+                    file_path = self.resource_creator.create(msg_wrapper.src,
+                                                             os.path.join(self.result_dir, sub_dir),
+                                                             file_size, i)
+                with tracer.span('publish'):
+                    file_hash = self.commands.publish(file_path)
+                with self._round_lock:
+                    self.pending_results[file_hash] += 1
+                protocol.send(sock, Result(file_hash, msg.round_id), dst=msg_wrapper.src)
+
+        return phase
+
+    def _finish(self):
+        with self._round_lock:
+            self.finishing = True
+            done = not self.pending_results
+        if done:
+            self.stop()
+
+    def _on_result_ack_message(self, protocol, sock, msg_wrapper):
+        result_hash = msg_wrapper.msg.result_hash
+        with self._round_lock:
+            self.pending_results[result_hash] -= 1
+            if self.pending_results[result_hash] <= 0:
+                del self.pending_results[result_hash]
+            done = self.finishing and not self.pending_results
+        if done:
+            self.stop()
+
+    def _schedule_request(self, protocol, sock, dst, think_time, round_id=None):
+        if think_time > 0:
+            timer = threading.Timer(think_time, self._request_resources,
+                                    args=(protocol, sock, dst, round_id))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._request_resources(protocol, sock, dst, round_id)
+
+    def _request_resources(self, protocol, sock, dst, round_id=None):
+        if self.working:
+            if self.tracer.enabled:
+                self.request_times[self.state.rounds if round_id is None else round_id] = time.time()
+            protocol.send(sock, GetResources(round_id), dst=dst)
+
+    def _download(self, peer, hashes, concurrency=1, round_number=None):
+
+        def get(_hash):
+            output_dir = os.path.join(self.resource_dir, "d_" + _hash)
+            with self.tracer.span('get', self.name, round_number), \
+                    timed_download(self.state, peer, self.commands.name, _hash,
+                                   output_dir, CLIENT_FETCH):
+                self.commands.get(_hash, output_dir)
+
+        if concurrency > 1:
+            if concurrency not in self.download_pools:
+                self.download_pools[concurrency] = ThreadPool(concurrency)
+            self.download_pools[concurrency].map(get, hashes)
+        else:
+            for _hash in hashes:
+                get(_hash)
 
     def _on_address_message(self, protocol, sock, msg_wrapper):
         if self.direct_connections:
@@ -142,7 +313,15 @@ class ResourceClientSession(ResourceSession, ClientProtocol):
             except Exception as exc:
                 log('Error connecting to {}: {}'.format(address, exc))
 
-        protocol.send(sock, GetResources(), dst=msg_wrapper.src)
+        if self.round_pool:
+            with self._round_lock:
+                window = min(self.pipeline, self.n_tasks - self.requested)
+                round_ids = range(self.requested, self.requested + window)
+                self.requested += window
+            for round_id in round_ids:
+                self._request_resources(protocol, sock, msg_wrapper.src, round_id)
+        else:
+            self._request_resources(protocol, sock, msg_wrapper.src)
 
     # Logic
 
@@ -153,8 +332,17 @@ class ResourceClientSession(ResourceSession, ClientProtocol):
 
     def set_up(self, state):
         ResourceSession.set_up(self, state)
+        if self.pipeline > 1:
+            self.round_pool = ThreadPool(self.pipeline)
         self.start()
 
+    def tear_down(self):
+        super(ResourceClientSession, self).tear_down()
+        for pool in self.download_pools.itervalues():
+            pool.close()
+        if self.round_pool:
+            self.round_pool.close()
+
     def stop(self):
         super(ResourceClientSession, self).stop()
         self.state.done = True
@@ -164,16 +352,39 @@ class ResourceServerSession(ResourceSession, ServerProtocol):
 
     __metaclass__ = ABCMeta
 
-    def __init__(self, name, address, output_dir, log_dir,
-                 file_size=10, proxy=None, connect=False):
-
-        ServerProtocol.__init__(self, name, address, proxy=proxy)
-        ResourceSession.__init__(self, output_dir, log_dir, file_size, connect=connect)
+    n_resources = 3
 
-        self.file_size = file_size
+    def __init__(self, name, address, output_dir, log_dir,
+                 file_size=10, proxy=None, connect=False, source=None, seed=None,
+                 cache=None, transport=None, raw_relay=True, version=VERSION,
+                 pool_depth=0, pool_budget=None, scenario=None, result_workers=4):
+
+        ServerProtocol.__init__(self, name, address, proxy=proxy,
+                                transport=transport, raw_relay=raw_relay,
+                                version=version)
+        ResourceSession.__init__(self, output_dir, log_dir, file_size, connect=connect,
+                                 source=source, seed=seed, cache=cache,
+                                 scenario=scenario or Scenario.default(resources=self.n_resources))
+
+        self.client_rounds = defaultdict(int)
+        # a round ends once all of its results are fetched
+        self.round_results = defaultdict(int)
+        self._round_results_lock = threading.Lock()
+        # results of pipelined rounds are fetched off the connection thread
+        self.result_workers = result_workers
+        self.result_pool = None
+        self._result_pool_lock = threading.Lock()
         self.resource_dir = os.path.join(self.output_dir, 'resources_server')
         self.result_dir = os.path.join(self.output_dir, 'results_server')
 
+        if pool_depth:
+            self.resource_pool = ResourcePool(self.commands, self.resource_creator,
+                                              os.path.join(self.output_dir, 'resources_pool'),
+                                              count=self.n_resources, depth=pool_depth,
+                                              budget=pool_budget)
+        else:
+            self.resource_pool = None
+
     # ServerProtocol
 
     def _on_get_address(self, protocol, sock, msg_wrapper):
@@ -181,22 +392,98 @@ class ResourceServerSession(ResourceSession, ServerProtocol):
         protocol.send(sock, Address(address), dst=msg_wrapper.src)
 
     def _on_get_resources_message(self, protocol, sock, msg_wrapper):
-        resources = []
-        self.commands.pre_publish()
-
-        for i in xrange(3):
-            sub_dir = str(uuid.uuid4())
-            file_path = self.resource_creator.create(msg_wrapper.src, os.path.join(self.resource_dir, sub_dir))
-            file_hash = self.commands.publish(file_path)
-            resources.append(file_hash)
-
-        protocol.send(sock, Resources(resources), dst=msg_wrapper.src)
+        round_id = msg_wrapper.msg.round_id
+        if round_id is None:
+            round_id = self.client_rounds[msg_wrapper.src]
+            self.client_rounds[msg_wrapper.src] += 1
+        phase = self.scenario.phase(round_id)
+
+        tracer = self.tracer
+        session = self._session_name(msg_wrapper.src)
+
+        if self.resource_pool:
+            with tracer.span('resources', session, round_id):
+                with tracer.span('pool'):
+                    resources = self.resource_pool.take((msg_wrapper.src, round_id)).hashes
+                protocol.send(sock, Resources(resources, msg_wrapper.msg.round_id),
+                              dst=msg_wrapper.src)
+            return
+
+        file_paths = []
+
+        with tracer.span('resources', session, round_id):
+            with tracer.span('pre_publish'):
+                self.commands.pre_publish()
+
+            for i in xrange(phase.resources):
+                sub_dir = str(uuid.uuid4())
+                file_size = self.scenario.sample(phase.resource_size, self.file_size)
+                with tracer.span('create'):
+                    file_path = self.resource_creator.create(msg_wrapper.src,
+                                                             os.path.join(self.resource_dir, sub_dir),
+                                                             file_size, i)
+                file_paths.append(file_path)
+
+        started = time.time()
+
+        def published(resources, error):
+            tracer.record('publish', started, time.time(), session, round_id)
+            if error:
+                log('Error publishing resources for {}: {}'.format(msg_wrapper.src, error))
+            else:
+                with tracer.span('respond', session, round_id):
+                    protocol.send(sock, Resources(resources, msg_wrapper.msg.round_id),
+                                  dst=msg_wrapper.src)
+
+        self.commands.publish_async(file_paths, published)
 
     def _on_result_message(self, protocol, sock, msg_wrapper):
+        if msg_wrapper.msg.round_id is not None and self.result_workers > 0:
+            with self._result_pool_lock:
+                if not self.result_pool:
+                    self.result_pool = ThreadPool(self.result_workers)
+            self.result_pool.apply_async(self._fetch_result, (protocol, sock, msg_wrapper))
+        else:
+            self._fetch_result(protocol, sock, msg_wrapper)
+
+    def _fetch_result(self, protocol, sock, msg_wrapper):
         msg = msg_wrapper.msg
-        with timed_download(self.state, protocol):
-            self.commands.get(msg.result_hash, os.path.join(self.result_dir, "d_" + msg.result_hash))
-        self.state.new_round()
+        output_dir = os.path.join(self.result_dir, "d_" + msg.result_hash)
+        # stop-and-wait results belong to the last requested round
+        round_id = msg.round_id if msg.round_id is not None \
+            else self.client_rounds[msg_wrapper.src] - 1
+
+        # the client has downloaded the round's resources before sending results
+        if self.resource_pool:
+            self.resource_pool.release((msg_wrapper.src, round_id))
+
+        try:
+            with self.tracer.span('fetch', self._session_name(msg_wrapper.src), round_id), \
+                    timed_download(self.state, msg_wrapper.src, self.commands.name,
+                                   msg.result_hash, output_dir, SERVER_FETCH):
+                self.commands.get(msg.result_hash, output_dir)
+        except Exception as exc:
+            if msg.round_id is None:
+                raise
+            log('Error fetching result {} of round {}: {}'.format(msg.result_hash,
+                                                                 msg.round_id, exc))
+            return
+        finally:
+            # the client may stop sharing the result now
+            protocol.send(sock, ResultAck(msg.result_hash, msg.round_id), dst=msg_wrapper.src)
+
+        key = (msg_wrapper.src, round_id)
+        with self._round_results_lock:
+            self.round_results[key] += 1
+            done = self.round_results[key] >= self.scenario.phase(round_id).results
+            if done:
+                del self.round_results[key]
+        if done:
+            self.state.new_round()
+
+    def _session_name(self, peer):
+        # rounds are numbered per client
+        return '{}/{}'.format(self.name, peer)
 
     # Logic
 
@@ -208,8 +495,14 @@ class ResourceServerSession(ResourceSession, ServerProtocol):
     def set_up(self, state):
         super(ResourceServerSession, self).set_up(state)
         state.timeout = -1
+        if self.resource_pool:
+            self.resource_pool.start()
         self.start()
 
     def tear_down(self):
+        if self.resource_pool:
+            self.resource_pool.stop()
+        if self.result_pool:
+            self.result_pool.close()
         super(ResourceServerSession, self).tear_down()
         self.stop()
@@ -0,0 +1,137 @@
+import os
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from collections import deque, namedtuple
+
+from common.util import log
+
+PoolItem = namedtuple('PoolItem', ['directory', 'file_paths', 'hashes', 'size'])
+
+
+class ResourcePool(object):
+
+    # Items are pre-generated and published by a background thread. A taken
+    # item is kept until the round it was taken for is released, i.e. its
+    # result has arrived, as the client may still be downloading it.
+
+    def __init__(self, commands, creator, directory, count=3, depth=2,
+                 budget=None):
+
+        self.commands = commands
+        self.creator = creator
+        self.directory = directory
+        self.count = count
+        self.depth = depth
+        self.budget = budget
+
+        self.ready = deque()
+        self.taken = dict()
+        self.used = 0
+
+        self.working = False
+        self.exception = None
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        self.working = True
+        self._thread = threading.Thread(target=self._produce)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self.working = False
+            self._condition.notify_all()
+
+        if self._thread:
+            self._thread.join()
+
+        for item in self.taken.values() + list(self.ready):
+            self._release(item)
+        self.taken.clear()
+        self.ready.clear()
+
+    def take(self, key, timeout=None):
+        deadline = time.time() + timeout if timeout is not None else None
+
+        with self._condition:
+            while not self.ready:
+                if self.exception:
+                    raise self.exception
+                if not self.working:
+                    raise RuntimeError('Resource pool is stopped')
+
+                remaining = deadline - time.time() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    raise RuntimeError('No pooled resources after {} s'.format(timeout))
+                self._condition.wait(remaining if remaining is not None else 1.)
+
+            item = self.ready.popleft()
+            previous = self.taken.pop(key, None)
+            self.taken[key] = item
+
+        # a round requested again; its previous item is no longer used
+        if previous:
+            self._release(previous)
+        return item
+
+    def release(self, key):
+        with self._condition:
+            item = self.taken.pop(key, None)
+
+        if item:
+            self._release(item)
+
+    def _produce(self):
+        item_size = self.count * self.creator.default_file_size * 1024 * 1024
+
+        try:
+            while self.working:
+
+                with self._condition:
+                    while self.working and not self._has_room(item_size):
+                        self._condition.wait(1.)
+                    if not self.working:
+                        return
+                    self.used += item_size
+
+                item = self._create(item_size)
+
+                with self._condition:
+                    self.ready.append(item)
+                    self._condition.notify_all()
+
+        except Exception as exc:
+            log('Resource pool error: {}'.format(exc))
+            traceback.print_exc()
+
+            with self._condition:
+                self.exception = exc
+                self._condition.notify_all()
+
+    def _has_room(self, item_size):
+        if len(self.ready) >= self.depth:
+            return False
+        if self.budget and self.used and self.used + item_size > self.budget:
+            return False
+        return True
+
+    def _create(self, item_size):
+        directory = os.path.join(self.directory, str(uuid.uuid4()))
+        file_paths = [self.creator.generate(directory, index=i) for i in xrange(self.count)]
+        hashes = [self.commands.publish(file_path) for file_path in file_paths]
+        return PoolItem(directory, file_paths, hashes, item_size)
+
+    def _release(self, item):
+        for file_path in item.file_paths:
+            self.commands.release(file_path)
+        if os.path.exists(item.directory):
+            shutil.rmtree(item.directory)
+
+        with self._condition:
+            self.used -= item.size
+            self._condition.notify_all()
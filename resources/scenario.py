@@ -0,0 +1,187 @@
+import json
+import math
+import random
+import threading
+
+SIZE_FIXED = 'fixed'
+SIZE_UNIFORM = 'uniform'
+SIZE_LOGNORMAL = 'lognormal'
+SIZE_TRACE = 'trace'
+
+
+class ScenarioError(Exception):
+    pass
+
+
+class Distribution(object):
+
+    # Sampled values are clamped to [min, max] when those are given
+
+    def __init__(self, kind=SIZE_FIXED, value=0., low=None, high=None, mu=0., sigma=0.,
+                 trace=None, minimum=None, maximum=None):
+        self.kind = kind
+        self.value = value
+        self.low = low
+        self.high = high
+        self.mu = mu
+        self.sigma = sigma
+        self.trace = trace or []
+        self.minimum = minimum
+        self.maximum = maximum
+        self._position = 0
+
+    @classmethod
+    def from_config(cls, config):
+        if config is None:
+            return None
+        if isinstance(config, (int, long, float)):
+            return cls(SIZE_FIXED, value=float(config))
+        if not isinstance(config, dict):
+            raise ScenarioError('Invalid distribution: {!r}'.format(config))
+
+        kind = config.get('type', SIZE_FIXED)
+        bounds = dict(minimum=config.get('min'), maximum=config.get('max'))
+
+        if kind == SIZE_FIXED:
+            return cls(kind, value=float(config['value']), **bounds)
+        elif kind == SIZE_UNIFORM:
+            return cls(kind, low=float(config['min']), high=float(config['max']))
+        elif kind == SIZE_LOGNORMAL:
+            if 'median' in config:
+                mu = math.log(float(config['median']))
+            else:
+                mu = float(config.get('mu', 0.))
+            return cls(kind, mu=mu, sigma=float(config.get('sigma', 1.)), **bounds)
+        elif kind == SIZE_TRACE:
+            trace = config.get('values') or load_trace(config['path'])
+            if not trace:
+                raise ScenarioError('Empty trace: {!r}'.format(config))
+            return cls(kind, trace=[float(v) for v in trace], **bounds)
+
+        raise ScenarioError('Unknown distribution type: {}'.format(kind))
+
+    def sample(self, rng):
+        if self.kind == SIZE_UNIFORM:
+            value = rng.uniform(self.low, self.high)
+        elif self.kind == SIZE_LOGNORMAL:
+            value = rng.lognormvariate(self.mu, self.sigma)
+        elif self.kind == SIZE_TRACE:
+            # traces are replayed in order
+            value = self.trace[self._position % len(self.trace)]
+            self._position += 1
+        else:
+            value = self.value
+
+        if self.minimum is not None:
+            value = max(self.minimum, value)
+        if self.maximum is not None:
+            value = min(self.maximum, value)
+        return value
+
+
+class Phase(object):
+
+    def __init__(self, name, rounds=None, resources=3, resource_size=None, results=1,
+                 result_size=None, think_time=None, concurrency=None):
+        self.name = name
+        self.rounds = rounds
+        self.resources = resources
+        self.resource_size = resource_size
+        self.results = results
+        self.result_size = result_size
+        self.think_time = think_time
+        self.concurrency = concurrency
+
+    @classmethod
+    def from_config(cls, config, index=0):
+        unknown = set(config) - {'name', 'rounds', 'resources', 'resource_size', 'results',
+                                 'result_size', 'think_time', 'concurrency'}
+        if unknown:
+            raise ScenarioError('Unknown phase options: {}'.format(', '.join(sorted(unknown))))
+
+        return cls(config.get('name', 'phase_{}'.format(index)),
+                   rounds=int(config['rounds']) if config.get('rounds') is not None else None,
+                   resources=int(config.get('resources', 3)),
+                   resource_size=Distribution.from_config(config.get('resource_size')),
+                   results=int(config.get('results', 1)),
+                   result_size=Distribution.from_config(config.get('result_size')),
+                   think_time=Distribution.from_config(config.get('think_time')),
+                   concurrency=int(config['concurrency'])
+                   if config.get('concurrency') is not None else None)
+
+
+class Scenario(object):
+
+    # Phases follow each other; a phase without a number of rounds lasts
+    # until the end of the session. Sizes are in MB, think time in seconds;
+    # unset sizes fall back to the session's --size, unset concurrency to
+    # its --concurrency.
+
+    def __init__(self, phases, seed=None, name=None):
+        if not phases:
+            raise ScenarioError('A scenario needs at least one phase')
+
+        self.phases = phases
+        self.name = name
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default(cls, rounds=None, resources=3):
+        return cls([Phase('default', rounds=rounds, resources=resources)])
+
+    @classmethod
+    def from_config(cls, config):
+        phases = [Phase.from_config(p, i) for i, p in enumerate(config.get('phases') or [])]
+        return cls(phases, seed=config.get('seed'), name=config.get('name'))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            content = f.read()
+
+        if path.endswith(('.yml', '.yaml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ScenarioError('YAML scenarios require the PyYAML package')
+            config = yaml.safe_load(content)
+        else:
+            config = json.loads(content)
+
+        return cls.from_config(config)
+
+    @property
+    def rounds(self):
+        if any(p.rounds is None for p in self.phases):
+            return None
+        return sum(p.rounds for p in self.phases)
+
+    def phase(self, round_number):
+        for phase in self.phases:
+            if phase.rounds is None or round_number < phase.rounds:
+                return phase
+            round_number -= phase.rounds
+        return self.phases[-1]
+
+    def sample(self, distribution, default=0.):
+        if distribution is None:
+            return default
+        with self._lock:
+            return distribution.sample(self.random)
+
+
+def load_trace(path):
+    # one value per line; empty lines and '#' comments are skipped
+    with open(path, 'rb') as f:
+        return [float(line.split(',')[0]) for line in f
+                if line.strip() and not line.startswith('#')]
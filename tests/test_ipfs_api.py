@@ -0,0 +1,179 @@
+import BaseHTTPServer
+import SocketServer
+import cgi
+import hashlib
+import json
+import os
+import shutil
+import socket
+import tarfile
+import tempfile
+import threading
+import unittest
+import urlparse
+from cStringIO import StringIO
+
+from resources.ipfs.api import IPFSApi, IPFSApiError
+from resources.ipfs.commands import IPFSCommands, IPFSAPICommands
+
+
+class FakeIPFSHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # The subset of the IPFS HTTP API used by IPFSApi, with files kept in
+    # memory by hash
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        command = url.path[len('/api/v0/'):]
+        args = urlparse.parse_qs(url.query).get('arg', [])
+        handler = getattr(self, '_' + command.replace('/', '_'), None)
+
+        if handler is None:
+            self._reply(404, json.dumps(dict(Message='unknown command')))
+        else:
+            handler(args)
+
+    def _id(self, args):
+        self._reply(200, json.dumps(dict(ID=self.server.node_id)))
+
+    def _add(self, args):
+        _, params = cgi.parse_header(self.headers['Content-Type'])
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        form = cgi.parse_multipart(StringIO(body), dict(boundary=params['boundary']))
+        data = form['file'][0]
+
+        file_hash = 'Qm' + hashlib.sha256(data).hexdigest()[:44]
+        self.server.files[file_hash] = data
+        self._reply(200, json.dumps(dict(Name=file_hash, Hash=file_hash)) + '\n')
+
+    def _get(self, args):
+        file_hash = args[0].split('/')[-1]
+        if file_hash not in self.server.files:
+            self._reply(500, json.dumps(dict(Message='not found')))
+            return
+
+        data = self.server.files[file_hash]
+        output = StringIO()
+        archive = tarfile.open(fileobj=output, mode='w')
+        info = tarfile.TarInfo(file_hash)
+        info.size = len(data)
+        archive.addfile(info, StringIO(data))
+        archive.close()
+        self._reply(200, output.getvalue(), 'application/x-tar')
+
+    def _reply(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeIPFSServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    # keep-alive connections of the client do not block shutdown
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), FakeIPFSHandler)
+        self.node_id = 'QmFakeNode'
+        self.files = dict()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+class RecordingCLICommands(IPFSCommands):
+
+    # Stands in for the ipfs executable in the CLI fallback
+
+    calls = []
+
+    @classmethod
+    def publish(cls, file_path):
+        cls.calls.append(('publish', file_path))
+        return 'QmFromCLI'
+
+
+class FallbackCommands(IPFSAPICommands, RecordingCLICommands):
+    pass
+
+
+class IPFSApiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeIPFSServer()
+        self.server.start()
+        self.directory = tempfile.mkdtemp()
+
+        self.file_path = os.path.join(self.directory, 'resource')
+        with open(self.file_path, 'wb') as f:
+            f.write(os.urandom(300 * 1024))
+
+    def tearDown(self):
+        FallbackCommands.api = None
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def _api(self):
+        host, port = self.server.server_address
+        return IPFSApi(host, port, timeout=10)
+
+    def test_add_get(self):
+        api = self._api()
+        self.assertEqual(api.id()['ID'], 'QmFakeNode')
+
+        file_hash = api.add(self.file_path)
+        self.assertIn(file_hash, self.server.files)
+
+        # twice, over the same keep-alive connection
+        for name in ('first', 'second'):
+            output_dir = os.path.join(self.directory, name)
+            os.makedirs(output_dir)
+            api.get('/ipfs/{}'.format(file_hash), output_dir)
+
+            with open(os.path.join(output_dir, file_hash), 'rb') as f, \
+                    open(self.file_path, 'rb') as original:
+                self.assertEqual(f.read(), original.read())
+
+    def test_get_missing(self):
+        with self.assertRaises(IPFSApiError):
+            self._api().get('/ipfs/QmMissing', self.directory)
+
+    def test_commands_use_the_api(self):
+        FallbackCommands.api = self._api()
+        RecordingCLICommands.calls = []
+
+        file_hash = FallbackCommands.publish(self.file_path)
+        self.assertIn(file_hash, self.server.files)
+        self.assertEqual(RecordingCLICommands.calls, [])
+
+    def test_commands_fall_back_to_the_cli(self):
+        # a port nothing listens on
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        FallbackCommands.api = IPFSApi('127.0.0.1', port, timeout=10)
+        RecordingCLICommands.calls = []
+
+        self.assertEqual(FallbackCommands.publish(self.file_path), 'QmFromCLI')
+        self.assertEqual(RecordingCLICommands.calls, [('publish', self.file_path)])
+
+
+if __name__ == '__main__':
+    unittest.main()
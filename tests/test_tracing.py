@@ -0,0 +1,43 @@
+import re
+import unittest
+
+from common.tracing import Span, Tracer
+
+
+class TracerTest(unittest.TestCase):
+
+    def setUp(self):
+        # a client round: the download on the main thread waits for two
+        # parallel gets, then the next resource is created and published
+        self.tracer = Tracer()
+        self._span('round', 'main', 0., 10.)
+        self._span('download', 'main', 0., 6.)
+        self._span('get', 'pool-1', 1., 5.)
+        self._span('get', 'pool-2', 1., 5.)
+        self._span('create', 'main', 6., 8.)
+        self._span('publish', 'main', 8., 9.)
+        self._span('send', 'main', 8.5, 9.)
+
+    def _span(self, name, thread, started, finished):
+        self.tracer.spans.append(Span(name, 'session', 0, thread, started, finished, {}))
+
+    def test_self_times(self):
+        entry, = self.tracer.breakdown()
+        self.assertEqual(entry['wall'], 10.)
+        self.assertEqual(entry['phases']['round'], 10.)
+
+        # the download shares the time of the gets with the two pool threads
+        expected = dict(round=1., download=2. + 4. / 3, get=8. / 3, create=2.,
+                        publish=.5, send=.5)
+        self.assertItemsEqual(entry['self'], expected)
+        for name, elapsed in expected.iteritems():
+            self.assertAlmostEqual(entry['self'][name], elapsed)
+
+    def test_shares_add_up_to_wall_time(self):
+        shares = re.findall(r'([\d.]+)% of wall time', self.tracer.report())
+        self.assertEqual(len(shares), 6)
+        self.assertLessEqual(sum(float(share) for share in shares), 100.)
+
+
+if __name__ == '__main__':
+    unittest.main()